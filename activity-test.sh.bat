@@ -1 +1 @@
-swipl -g "['../etalis-test/etalis/src/etalis.P'], set_etalis_flag(event_consumption_policy,recent), set_etalis_flag(logging_to_file,on), set_etalis_flag(store_fired_events,on), compile_events('./activity-test.event'), execute_event_stream_file('./input.stream'), findall(event(hla(U, X, meta(Ts, Cert)), [T1, T2]), fired_event(hla(U, X, meta(Ts, Cert)), [T1, T2]), List), write_list_to_file(List, './hla_output.stream'), halt."
\ No newline at end of file
+swipl -g "['../etalis-test/etalis/src/etalis.P'], set_etalis_flag(event_consumption_policy,recent), set_etalis_flag(logging_to_file,on), set_etalis_flag(event_sink,on), open_event_sink('./hla_output.stream', hla(_, _, meta(_, _))), compile_events('./activity-test.event'), execute_event_stream_file('./input.stream'), close_event_sink, halt."
\ No newline at end of file
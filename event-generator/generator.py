@@ -1,20 +1,42 @@
 import datetime
-import events
+from scep import events
 import sys, os
 
+from stats import GeneratorStats
+
 class Generator(object):
     def __init__(self, hla_list, output_stream):
         self.hla_list = hla_list
         self.output_stream = output_stream
+        self.stats = GeneratorStats()
+
+    def generate(self, with_sleep = False, report_file = None):
+        '''
+        Generate the events of all HLAs and write them to the output stream.
+        Counters and timings are accumulated in self.stats.
+        :param with_sleep: Specifies if sleep(x) statements are inserted in final event stream output. Default FALSE.
+        :param report_file: optional path of a JSON report of the stats
+        :return: the GeneratorStats
+        '''
+        stats = self.stats
+        for hla in self.hla_list:
+            with stats.timer("sampling"):
+                event_list = hla.generate(with_sleep=with_sleep, stats=stats)
+
+            stats.count_events(hla, event_list)
+
+            with stats.timer("serialization"):
+                lines = ["%% ======== HLA: " + hla.type + " ======== "]
+                lines.extend(event.to_etalis() for event in event_list)
+                lines.append(os.linesep)
+
+            with stats.timer("io"):
+                self.output_stream.write("\n".join(lines) + "\n")
 
-    def generate(self, with_sleep = False):
-        for hla in hla_list:
-            event_list = hla.generate(with_sleep=with_sleep)
-            print >> self.output_stream, "%% ======== HLA: " + hla.type + " ======== "
-            for event in event_list:
-                print >> self.output_stream, event.to_etalis()
+        if report_file:
+            stats.write_json(report_file)
 
-            print >> self.output_stream, os.linesep
+        return stats
 
 
 if __name__ == "__main__":
@@ -110,6 +132,6 @@ if __name__ == "__main__":
     with open("../single_hla_120s_01er_015fd_with_sleep.stream", "w") as outfile:
     #with open("../single_hla_120s_01er_015fd.stream", "w") as outfile:
         gen = Generator(hla_list, outfile)
-        gen.generate(with_sleep=True)
+        gen.generate(with_sleep=True, report_file="../single_hla_120s_01er_015fd_with_sleep.stats.json")
 
-        print "Done. Event stream generated!"
\ No newline at end of file
+        print "Done. Event stream generated! %d events" % gen.stats.total_events
\ No newline at end of file
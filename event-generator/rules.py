@@ -0,0 +1,123 @@
+'''
+Generates the (position, LLA) -> HLA rules of the ETALIS rule file from the generator vocabulary (events.vocabulary_tables()), so that
+the rules and the generated streams use the same Positions, LLAs and HLAs.
+
+The rules are written between the GENERATED_BEGIN and GENERATED_END marker lines of a template rule file (by default
+activity-test.event itself); the rest of the template - context flags, pos/lla validity extension rules, generic hla
+rules - is copied as is. The rules can be restricted to a set of HLAs, or to the HLAs whose (LLA, Position)
+combinations occur in a workload stream, so that the engine does not keep goal-store state for rules that never fire.
+'''
+from __future__ import print_function
+
+import argparse, os, re, sys
+
+from scep.events import vocabulary_tables, HLA
+
+GENERATED_BEGIN = "%% ==== BEGIN GENERATED HLA RULES (event-generator/rules.py) ===="
+GENERATED_END   = "%% ==== END GENERATED HLA RULES ===="
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "activity-test.event")
+
+HLA_RULE = """%% {hla}: {lla} at {position}
+r_hla_{hla}_{idx} 'rule:' hla(U,{hla},meta(L,ScoreHLA))
+    <-  (pos(U,{position},meta(L1,ScorePos)) 'timestamp' t1(T1), t2(T2), less_datime(T1,T2))
+        'intersects'
+        (lla(U,{lla},meta(L2,ScoreLLA)) 'timestamp' t1(T3), t2(T4), less_datime(T3,T4))
+        'where' (
+            L is max(L1,L2),
+            aggr_score(ScorePos,ScoreLLA,ScoreHLA)
+        )."""
+
+STREAM_EVENT_REGEX = re.compile(r"event\((pos|lla)\(\s*\w+\s*,\s*(\w+)\s*,")
+
+
+def hla_rules(hlas = None):
+    '''
+    :param hlas: HLA types to generate the rules of (default: all defined HLAs)
+    :return: list of rule texts
+    '''
+    tables = vocabulary_tables()
+    rules = []
+    for hla in tables.hlas:
+        if hlas is not None and hla not in hlas:
+            continue
+        for idx, combination in enumerate(tables.combinations_of(hla), 1):
+            rules.append(HLA_RULE.format(hla=hla, idx=idx, position=combination["position"], lla=combination["lla"]))
+
+    return rules
+
+
+def stream_hlas(lines):
+    '''
+    HLAs whose (LLA, Position) combinations can be recognized from the pos/lla values present in a stream
+    :param lines: iterable of stream lines
+    :return: set of HLA types
+    '''
+    present = {"pos": set(), "lla": set()}
+    for line in lines:
+        match = STREAM_EVENT_REGEX.search(line)
+        if match:
+            present[match.group(1)].add(match.group(2))
+
+    tables = vocabulary_tables()
+    return set(hla for hla in tables.hlas
+               if any(combination["position"] in present["pos"] and combination["lla"] in present["lla"]
+                      for combination in tables.combinations_of(hla)))
+
+
+def render(template_text, rules):
+    '''
+    Replace the generated section of a rule file template
+    :return: the new rule file text
+    '''
+    begin = template_text.find(GENERATED_BEGIN)
+    end = template_text.find(GENERATED_END)
+    if begin < 0 or end < begin:
+        raise ValueError("Template has no " + GENERATED_BEGIN + " ... " + GENERATED_END + " section")
+
+    return (template_text[:begin + len(GENERATED_BEGIN)] + "\n\n"
+            + "\n\n".join(rules) + ("\n\n" if rules else "")
+            + template_text[end:])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Generate the hla rules of the ETALIS rule file from the generator HLAs.")
+    parser.add_argument("output", help="rule file to write ('-' for stdout); may be the template itself")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="rule file template (default: activity-test.event)")
+    parser.add_argument("--hlas", default=None, help="comma separated HLA types to generate rules for")
+    parser.add_argument("--stream", action="append", default=None,
+                        help="only generate the rules of the HLAs recognizable from this stream (repeatable)")
+    args = parser.parse_args(argv)
+
+    hlas = None
+    if args.hlas:
+        hlas = set(hla.strip() for hla in args.hlas.split(",") if hla.strip())
+        unknown = hlas - set(vocabulary_tables().hlas)
+        if unknown:
+            parser.error("unknown HLA types: " + ", ".join(sorted(unknown)))
+    if args.stream:
+        present = set()
+        for stream_file in args.stream:
+            with open(stream_file) as infile:
+                present |= stream_hlas(infile)
+        hlas = present if hlas is None else hlas & present
+
+    rules = hla_rules(hlas)
+
+    with open(args.template) as infile:
+        text = render(infile.read(), rules)
+
+    if args.output == "-":
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w") as outfile:
+            outfile.write(text)
+
+    print("%d hla rules generated for: %s" % (len(rules), ", ".join(
+        hla for hla in vocabulary_tables().hlas if hla != HLA.UNDEFINED and (hlas is None or hla in hlas))), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
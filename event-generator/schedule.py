@@ -0,0 +1,280 @@
+'''
+Markov-chain day schedules: the sequence of defined HLAs a person goes through, and their durations, are sampled from a
+transition matrix over the HLA types; UNDEFINED transitions are inserted between consecutive HLAs taking place in
+different areas, with a duration proportional to the distance between the areas in the Position.AREA_ADJACENCY graph.
+
+The events of several persons and days are produced lazily and merged by timestamp, so arbitrarily large workloads
+are written with the memory of one HLA per person.
+'''
+from __future__ import print_function
+
+import argparse, collections, datetime, heapq, random, sys
+
+import numpy as np
+
+from scep import events
+from scep.events import HLA, Position
+from stats import GeneratorStats
+
+## HLA type -> class of the defined HLAs
+HLA_CLASSES = collections.OrderedDict([
+    (HLA.WORKING,       events.WorkingHLA),
+    (HLA.DISCUSSING,    events.DiscussingHLA),
+    (HLA.DINING,        events.DiningHLA),
+    (HLA.SNACKING,      events.SnackingHLA),
+    (HLA.ENTERTAINMENT, events.EntertainmentHLA),
+    (HLA.EXERCISING,    events.ExerciseHLA),
+    (HLA.HYGENE,        events.HygeneHLA),
+])
+
+## HLA type -> {next HLA type: probability}; rows are normalized, missing types have probability 0
+DEFAULT_TRANSITIONS = {
+    HLA.WORKING:        {HLA.WORKING: 0.1, HLA.DISCUSSING: 0.3, HLA.DINING: 0.15, HLA.SNACKING: 0.2,
+                         HLA.ENTERTAINMENT: 0.1, HLA.EXERCISING: 0.05, HLA.HYGENE: 0.1},
+    HLA.DISCUSSING:     {HLA.WORKING: 0.6, HLA.DINING: 0.1, HLA.SNACKING: 0.15, HLA.HYGENE: 0.15},
+    HLA.DINING:         {HLA.WORKING: 0.5, HLA.DISCUSSING: 0.1, HLA.ENTERTAINMENT: 0.2, HLA.HYGENE: 0.2},
+    HLA.SNACKING:       {HLA.WORKING: 0.7, HLA.DISCUSSING: 0.2, HLA.ENTERTAINMENT: 0.1},
+    HLA.ENTERTAINMENT:  {HLA.WORKING: 0.6, HLA.SNACKING: 0.2, HLA.EXERCISING: 0.2},
+    HLA.EXERCISING:     {HLA.HYGENE: 0.6, HLA.WORKING: 0.2, HLA.SNACKING: 0.2},
+    HLA.HYGENE:         {HLA.WORKING: 0.8, HLA.DISCUSSING: 0.1, HLA.DINING: 0.1},
+}
+
+## probability of the first HLA of a day
+DEFAULT_INITIAL = {HLA.WORKING: 0.7, HLA.DISCUSSING: 0.2, HLA.SNACKING: 0.1}
+
+## HLA type -> (mean, standard deviation) of its duration, in seconds
+DEFAULT_DURATIONS = {
+    HLA.WORKING:        (2400, 900),
+    HLA.DISCUSSING:     (1200, 600),
+    HLA.DINING:         (1800, 300),
+    HLA.SNACKING:       (300, 120),
+    HLA.ENTERTAINMENT:  (900, 300),
+    HLA.EXERCISING:     (1200, 300),
+    HLA.HYGENE:         (240, 60),
+}
+
+MIN_HLA_DURATION = 10
+
+## UNDEFINED transition duration per hop between areas, in seconds
+DEFAULT_TRANSITION_HOP_DURATION = 5
+
+DEFAULT_DAY_START = datetime.datetime(2016, 6, 13, 9, 0, 0)
+DEFAULT_DAY_DURATION = 8 * 3600
+
+
+def area_distances(adjacency = Position.AREA_ADJACENCY):
+    '''
+    Number of hops between every two areas, in the (undirected) adjacency graph
+    :param adjacency: dict area -> list of adjacent areas
+    :return: dict (area, area) -> hops; unreachable pairs are missing
+    '''
+    neighbours = collections.defaultdict(set)
+    for area, adjacent in adjacency.items():
+        for other in adjacent:
+            neighbours[area].add(other)
+            neighbours[other].add(area)
+
+    distances = {}
+    for source in neighbours:
+        distances[(source, source)] = 0
+        queue = collections.deque([source])
+        while queue:
+            area = queue.popleft()
+            for other in neighbours[area]:
+                if (source, other) not in distances:
+                    distances[(source, other)] = distances[(source, area)] + 1
+                    queue.append(other)
+
+    return distances
+
+
+class TransitionMatrix(object):
+    '''
+    Row-stochastic matrix over the defined HLA types, with cumulative rows for sampling
+    '''
+    def __init__(self, transitions = None, initial = None):
+        self.types = list(HLA_CLASSES.keys())
+        self.index = dict((type, idx) for idx, type in enumerate(self.types))
+
+        self.matrix = self._normalize(np.array([self._row(transitions.get(type, {})) for type in self.types]
+                                               if transitions else
+                                               [self._row(DEFAULT_TRANSITIONS[type]) for type in self.types]))
+        self.initial = self._normalize(np.array([self._row(initial if initial else DEFAULT_INITIAL)]))[0]
+
+        self.cumulative = np.cumsum(self.matrix, axis=1)
+        self.initial_cumulative = np.cumsum(self.initial)
+
+    def _row(self, probabilities):
+        row = [0.0] * len(self.types)
+        for type, probability in probabilities.items():
+            if type not in self.index:
+                raise ValueError("Unknown HLA type in transition matrix: " + str(type))
+            row[self.index[type]] = probability
+        return row
+
+    @staticmethod
+    def _normalize(matrix):
+        totals = matrix.sum(axis=1)
+        if (totals <= 0).any():
+            raise ValueError("Transition matrix rows must have a positive sum")
+        return matrix / totals[:, np.newaxis]
+
+    def first(self, rng):
+        return self.types[int(np.searchsorted(self.initial_cumulative, rng.random_sample(), side="right"))]
+
+    def next(self, type, rng):
+        row = self.cumulative[self.index[type]]
+        return self.types[min(int(np.searchsorted(row, rng.random_sample(), side="right")), len(self.types) - 1)]
+
+
+class DaySchedule(object):
+    '''
+    Samples the HLAs of person-days from a TransitionMatrix
+    '''
+    def __init__(self, matrix = None, durations = None, step = events.DEFAULT_UPDATE_STEP,
+                 error_rate = 0, false_detect_rate = 0, hop_duration = DEFAULT_TRANSITION_HOP_DURATION, seed = None):
+        self.matrix = matrix if matrix else TransitionMatrix()
+        self.durations = durations if durations else DEFAULT_DURATIONS
+        self.step = step
+        self.error_rate = error_rate
+        self.false_detect_rate = false_detect_rate
+        self.hop_duration = hop_duration
+        self.distances = area_distances()
+        self.rng = np.random.RandomState(seed)
+
+    def sample_duration(self, type):
+        mean, sigma = self.durations[type]
+        return max(MIN_HLA_DURATION, int(round(self.rng.normal(mean, sigma))))
+
+    def transition_duration(self, from_pos, to_pos):
+        hops = self.distances.get((from_pos, to_pos))
+        if hops is None:
+            hops = len(Position.AREA_ADJACENCY)
+        return hops * self.hop_duration
+
+    def _make_hla(self, type, person, start_time, duration):
+        hla = HLA_CLASSES[type](person=person, start_time=start_time, duration=duration,
+                                lla_step=self.step, pos_step=self.step)
+        hla.lla_error_rate = hla.pos_error_rate = self.error_rate
+        hla.lla_false_detect_rate = hla.pos_false_detect_rate = self.false_detect_rate
+        return hla
+
+    def hlas(self, person, start_time = DEFAULT_DAY_START, day_duration = DEFAULT_DAY_DURATION):
+        '''
+        Sample the HLAs of one person-day, chained with UNDEFINED transitions where the area changes.
+        An UNDEFINED HLA is yielded right before the HLA following it, which it needs for its generation.
+        :return: generator of HLAs, in time order
+        '''
+        end_time = start_time + datetime.timedelta(seconds=day_duration)
+        current = start_time
+        previous = None
+        type = self.matrix.first(self.rng)
+
+        while current < end_time:
+            duration = self.sample_duration(type)
+            hla = self._make_hla(type, person, current, duration)
+
+            if previous is not None and previous.active_pos != hla.active_pos:
+                undef_duration = self.transition_duration(previous.active_pos, hla.active_pos)
+                undef_hla = events.UndefinedHLA(person=person, start_time=current, duration=undef_duration,
+                                                lla_step=self.step, pos_step=self.step)
+                undef_hla.preceded_by = previous
+
+                ## the UNDEFINED HLA also covers the non-overlap intervals of both sides
+                hla.start_time = current + datetime.timedelta(
+                    seconds=undef_duration + 2 * events.DEFAULT_NON_OVERLAP_DURATION)
+                hla.preceded_by = undef_hla
+                yield undef_hla
+
+            yield hla
+
+            current = hla.start_time + datetime.timedelta(seconds=duration)
+            previous = hla
+            type = self.matrix.next(type, self.rng)
+
+
+def person_events(schedule, person, days, day_start = DEFAULT_DAY_START, day_duration = DEFAULT_DAY_DURATION,
+                  stats = None):
+    '''
+    Events of one person over several days, in timestamp order, generated one HLA at a time
+    '''
+    for day in range(days):
+        start_time = day_start + datetime.timedelta(days=day)
+        for hla in schedule.hlas(person, start_time, day_duration):
+            event_list = hla.generate(stats=stats)
+            if stats:
+                stats.count_events(hla, event_list)
+            for event in event_list:
+                yield event
+
+
+def merged_events(schedule, persons, days, day_start = DEFAULT_DAY_START, day_duration = DEFAULT_DAY_DURATION,
+                  stats = None):
+    '''
+    Events of all persons, merged by timestamp
+    :param persons: list of person names
+    '''
+    def keyed(idx, person):
+        for seq, event in enumerate(person_events(schedule, person, days, day_start, day_duration, stats)):
+            yield (event.timestamp, idx, seq, event)
+
+    for _, _, _, event in heapq.merge(*[keyed(idx, person) for idx, person in enumerate(persons)]):
+        yield event
+
+
+def write_stream(output, schedule, persons, days, day_start = DEFAULT_DAY_START, day_duration = DEFAULT_DAY_DURATION,
+                 stats = None):
+    '''
+    Write the merged events of all persons to a stream
+    :return: number of events written
+    '''
+    written = 0
+    for event in merged_events(schedule, persons, days, day_start, day_duration, stats):
+        output.write(event.to_etalis() + "\n")
+        written += 1
+
+    return written
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Generate a workload of Markov-chain sampled person-days.")
+    parser.add_argument("output", help="output event stream ('-' for stdout)")
+    parser.add_argument("--persons", type=int, default=1)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--day-duration", type=int, default=DEFAULT_DAY_DURATION, help="seconds per day")
+    parser.add_argument("--step", type=float, default=events.DEFAULT_UPDATE_STEP,
+                        help="LLA/Position update step, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--false-detect-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None, help="JSON file receiving the generation stats")
+    args = parser.parse_args(argv)
+
+    ## the HLAs sample their certainties and errors from the global generators
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    stats = GeneratorStats()
+
+    schedule = DaySchedule(step=args.step, error_rate=args.error_rate, false_detect_rate=args.false_detect_rate,
+                           seed=args.seed)
+    persons = ["person%d" % idx for idx in range(args.persons)]
+
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        with stats.timer("total"):
+            written = write_stream(outfile, schedule, persons, args.days, day_duration=args.day_duration, stats=stats)
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    if args.report:
+        stats.write_json(args.report)
+
+    print("%d events written for %d person-days" % (written, args.persons * args.days), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
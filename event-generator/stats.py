@@ -0,0 +1,59 @@
+import json, timeit
+from collections import defaultdict
+from contextlib import contextmanager
+
+from scep.events import AtomicEvent, Delay
+
+
+class GeneratorStats(object):
+    '''
+    Counters and timers of an event generation run.
+    Counters are grouped (e.g. "events_per_type", "false_detects") and keyed by name; timers accumulate the seconds
+    spent in a phase ("sampling", "serialization", "io").
+    '''
+    def __init__(self):
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.timers = defaultdict(float)
+
+    def count(self, group, key, amount = 1):
+        self.counters[group][key] += amount
+
+    @contextmanager
+    def timer(self, phase):
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.timers[phase] += timeit.default_timer() - start
+
+    def count_events(self, hla, event_list):
+        '''
+        Count the events generated for an HLA per type (Position / LLA), per value, per person and per HLA
+        :param hla: the HLA the events were generated for
+        :param event_list: list returned by HLA.generate
+        '''
+        self.count("hlas", hla.type)
+        for event in event_list:
+            if isinstance(event, AtomicEvent):
+                self.count("events_per_type", event.__class__.__name__)
+                self.count("events_per_value", event.type)
+                self.count("events_per_person", event.person)
+                self.count("events_per_hla", hla.type)
+            elif isinstance(event, Delay):
+                self.count("delays", "count")
+                self.count("delays", "seconds", event.delay)
+
+    @property
+    def total_events(self):
+        return sum(self.counters["events_per_type"].values())
+
+    def to_dict(self):
+        return {
+            "total_events": self.total_events,
+            "counters": dict((group, dict(values)) for group, values in self.counters.items()),
+            "timers": dict(self.timers)
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as outfile:
+            json.dump(self.to_dict(), outfile, indent=2, sort_keys=True)
@@ -1,14 +1,9 @@
-import matplotlib.pyplot as plt
-from matplotlib.dates import DateFormatter, MinuteLocator, SecondLocator
-import numpy as np
-from StringIO import StringIO
+## matplotlib and numpy are imported by the plotting functions, so that importing the module stays cheap
 import datetime
+import sys
 import time
-from pytz import timezone
 import re
 
-from multiprocessing import Process
-
 HLA_TYPE = "hla"
 LLA_TYPE = "lla"
 POS_TYPE = "pos"
@@ -37,12 +32,18 @@ def extractData(inputData):
 
 def timelines(y, xstart, xstop, color='b'):
     """Plot timelines at y from xstart to xstop with given color."""   
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     plt.hlines(y, xstart, xstop, color, lw=4)
     plt.scatter(xstart,y,s=100,c=color,marker=".",lw=2,edgecolor=color)
     plt.scatter(xstop,y,s=100,c=color,marker=".",lw=2,edgecolor=color)
     plt.xticks(np.arange(min(xstart), max(xstop)+1, 5.0))
 
 def plotEventStream(inputStream):
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     data = np.genfromtxt(extractData(inputStream), 
         names=['input_type', 'user', 'input_value', 'last_update', 'confidence', 'start_time', 'end_time'], dtype=None, delimiter=',')
     input_type, user, input_value, last_update, confidence, start_time, end_time = data['input_type'], data['user'], data['input_value'], data['last_update'], data['confidence'], data['start_time'], data['end_time']
@@ -163,11 +164,16 @@ def plotEventStream(inputStream):
     # plt.xlabel('Time')
     # plt.show()
 
-f = open("../output2.stream")
-g = open("../output3.stream")
-p1 = Process(target=plotEventStream,args=([g]))
-p2 = Process(target=plotEventStream,args=([f]))
-p1.start()
-p2.start()
-p1.join()
-p2.join()
\ No newline at end of file
+def main(argv):
+    from multiprocessing import Process
+
+    ## one plotting process per stream (default: the outputs of two rule file versions)
+    streamFiles = argv if argv else ["../output2.stream", "../output3.stream"]
+    processes = [Process(target=plotEventStream, args=([open(streamFile)])) for streamFile in streamFiles]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,10 @@
+'''
+Core of the activity recognition tools, importable without side effects and with the standard library only:
+
+- scep.events:  event model of the generator (Positions, LLAs, HLAs) and its ETALIS stream form;
+- scep.streams: parser and serializer of ETALIS event stream files;
+- scep.tables:  NumPy-coded vocabulary tables, imported on first use by scep.events.
+
+The event-generator and stream-tools scripts import the package, installed with pip install -e . (see setup.py).
+python -m scep.startup checks the import time of the core.
+'''
@@ -1,8 +1,12 @@
+'''
+Event model of the generator: Positions, LLAs and HLAs, and their ETALIS stream form.
+
+The module only depends on the standard library at import time: NumPy is imported by the functions sampling from it,
+and the integer-coded vocabulary tables (scep.tables) are built on the first vocabulary_tables() call.
+'''
 import datetime, random
-import numpy as np
 
-from scipy.stats import rv_discrete
-from utils import GaussianPosTransition
+from .utils import GaussianPosTransition
 
 DEFAULT_DURATION         = 10
 DEFAULT_NON_OVERLAP_DURATION = 2
@@ -63,6 +67,8 @@ class AtomicEvent(object):
         if mu < 0.65 or mu > 1:
             return 0.85
 
+        import numpy as np
+
         val = np.random.normal(mu, sigma)
         if val < 0.65:
             val = 0.65
@@ -83,6 +89,8 @@ class AtomicEvent(object):
         if mu < 0.2 or mu > 0.5:
             return 0.35
 
+        import numpy as np
+
         val = np.random.normal(mu, sigma)
         if val < 0.2:
             val = 0.2
@@ -165,6 +173,8 @@ class LLA(AtomicEvent):
     SITTING     = "sitting"
     STANDING    = "standing"
 
+    TYPES = [WALKING, SITTING, STANDING]
+
     LLA_ADJACENCY = {
         WALKING:    [STANDING],
         STANDING:   [WALKING],
@@ -201,6 +211,8 @@ class Position(AtomicEvent):
     EXERCISE_AREA       = "exercise_area"
     HYGENE_AREA         = "hygene_area"
 
+    AREAS = [WORK_AREA, CONFERENCE_AREA, ENTERTAINMENT_AREA, DINING_AREA, SNACK_AREA, EXERCISE_AREA, HYGENE_AREA]
+
     AREA_ADJACENCY = {
         WORK_AREA:          [DINING_AREA],
         CONFERENCE_AREA:    [DINING_AREA, ENTERTAINMENT_AREA],
@@ -243,6 +255,8 @@ class HLA(object):
     HYGENE              = "hygene"
     UNDEFINED           = "undefined"
 
+    TYPES = [WORKING, DISCUSSING, ENTERTAINMENT, DINING, SNACKING, EXERCISING, HYGENE, UNDEFINED]
+
 
     def __init__(self, type = UNDEFINED, person = DEFAULT_PERSON,
                  start_time = datetime.datetime.today(), duration = DEFAULT_DURATION,
@@ -287,18 +301,24 @@ class HLA(object):
         self.lla_false_detect_rate = 0
         self.pos_false_detect_rate = 0
 
-        ## list of accepted (LLA, Position) compositions
-        self.accepted_combinations = accepted_combinations
+        ## list of accepted (LLA, Position) compositions; by default the ones of HLA_COMBINATIONS for the HLA type
+        self._custom_combinations = accepted_combinations is not None
+        self.accepted_combinations = accepted_combinations if self._custom_combinations else vocabulary_tables().combinations_of(type)
 
         ## Select the actual chosen position and LLA from the available combinations allowed for this HLA
         self._select_active_combination()
 
 
     def _select_active_combination(self):
-        if self.accepted_combinations:
-            comb_idx = random.randint(0, len(self.accepted_combinations) - 1)
-            self.active_pos = self.accepted_combinations[comb_idx]['position']
-            self.active_lla = self.accepted_combinations[comb_idx]['lla']
+        if self._custom_combinations:
+            if self.accepted_combinations:
+                comb_idx = random.randint(0, len(self.accepted_combinations) - 1)
+                self.active_pos = self.accepted_combinations[comb_idx]['position']
+                self.active_lla = self.accepted_combinations[comb_idx]['lla']
+        else:
+            combination = vocabulary_tables().sample_combination(self.type, random.random())
+            if combination:
+                self.active_lla, self.active_pos = combination
 
     '''
     Getters and setter for HLAs preceding and following the current one
@@ -470,20 +490,18 @@ class HLA(object):
 
 
 
-    def generate(self, with_sleep = False):
+    def generate(self, with_sleep = False, stats = None):
         '''
         Main event generation function for current HLA.
         :param with_sleep: Specifies if sleep(x) statements are inserted in final event stream output. Default FALSE.
+        :param stats: optional stats.GeneratorStats, receiving the error / false detect injection and transition counters
         :return:
         '''
         event_list = []
 
-        ## generate discrete distributions from which to sample for error_rate and false_detect_rate flags
-        pos_error_distrib = rv_discrete(values=([True, False], [self.pos_error_rate, 1 - self.pos_error_rate]))
-        lla_error_distrib = rv_discrete(values=([True, False], [self.lla_error_rate, 1 - self.lla_error_rate]))
-
-        pos_fd_distrib = rv_discrete(values=([True, False], [self.pos_false_detect_rate, 1 - self.pos_false_detect_rate]))
-        lla_fd_distrib = rv_discrete(values=([True, False], [self.lla_false_detect_rate, 1 - self.lla_false_detect_rate]))
+        ## error_rate and false_detect_rate flags are Bernoulli samples: random.random() < rate
+        pos_error_rate, lla_error_rate = self.pos_error_rate, self.lla_error_rate
+        pos_fd_rate, lla_fd_rate = self.pos_false_detect_rate, self.lla_false_detect_rate
 
 
         ## Handle generation for UNDEFINED HLA
@@ -514,6 +532,10 @@ class HLA(object):
                     aux_list.extend(aux_overlap_events)
                     aux_list.extend(aux_rampdown_events)
 
+                    if stats:
+                        stats.count("transition_events", "non_overlap", len(aux_overlap_events))
+                        stats.count("transition_events", "rampdown", len(aux_rampdown_events))
+
                 if next_pos:
                     ## generate rampup events
                     aux_rampup_events, transition_start = HLA.generate_simple_rampup_transition(next_pos, LLA.WALKING, transition_start, self.duration, self.pos_step, self.lla_step, self.person)
@@ -524,6 +546,10 @@ class HLA(object):
                     aux_list.extend(aux_rampup_events)
                     aux_list.extend(aux_overlap_events)
 
+                    if stats:
+                        stats.count("transition_events", "rampup", len(aux_rampup_events))
+                        stats.count("transition_events", "non_overlap", len(aux_overlap_events))
+
                 ## gather all transition events in aux list and sort them by timestamp
                 aux_list.sort(key=lambda ev: ev.timestamp)
 
@@ -534,6 +560,11 @@ class HLA(object):
         else:
             ## We can only generate smth if we have valid Position and LLA instances
             if self.active_pos and self.active_lla:
+                ## table indexes of the active Position and LLA, for false detection sampling
+                tables = vocabulary_tables()
+                pos_idx = tables.position_index[self.active_pos]
+                lla_idx = tables.lla_index[self.active_lla]
+
                 computed_duration = 0
                 ts_pos = ts_lla = current_ts = self.start_time
 
@@ -549,10 +580,10 @@ class HLA(object):
                             ''' ======== Generate position event if possible ======== '''
                             if ts_pos < ts_limit:
                                 ## sample probability of Position certainty error
-                                pos_error = pos_error_distrib.rvs()
+                                pos_error = random.random() < pos_error_rate
 
                                 ## sample probability of false Position detection error
-                                pos_fd = pos_fd_distrib.rvs()
+                                pos_fd = random.random() < pos_fd_rate
 
                                 if not pos_error:
                                     ## generate high certainty Position event
@@ -566,14 +597,16 @@ class HLA(object):
                                     # event_list.append(pos)
 
                                     ## if false detection flag enabled
+                                    if stats:
+                                        stats.count("errors", "pos")
+
                                     if pos_fd:
-                                        print "POS " + self.active_pos + " is fucked up to ",
                                         ## generate a falsely detected Position event according to "reasonable false positives" (see ADJACENCY dict for each Position)
-                                        false_pos_types = Position.AREA_ADJACENCY.get(self.active_pos)
-                                        if false_pos_types:
-                                            idx = random.randint(0, len(false_pos_types) - 1)
-                                            false_pos_type = false_pos_types[idx]
-                                            print false_pos_type
+                                        false_pos_type = tables.sample_false_position(pos_idx, random.random())
+                                        if false_pos_type:
+                                            if stats:
+                                                stats.count("false_detects", "pos")
+                                                stats.count("false_detect_pairs", self.active_pos + " -> " + false_pos_type)
 
                                             cert = AtomicEvent.get_fp_certainty_value(DEFAULT_TP_MU, DEFAULT_TP_SIGMA)
                                             pos = Position(type=false_pos_type, person=self.person, timestamp=ts_pos, certainty=cert)
@@ -585,10 +618,10 @@ class HLA(object):
                             ''' ======== Generate LLA event if possible ======== '''
                             if ts_lla < ts_limit:
                                 ## sample probability of LLA certainty error
-                                lla_error = lla_error_distrib.rvs()
+                                lla_error = random.random() < lla_error_rate
 
                                 ## sample probability of false LLA detection error
-                                lla_fd = lla_fd_distrib.rvs()
+                                lla_fd = random.random() < lla_fd_rate
 
                                 if not lla_error:
                                     ## generate high certainty LLA event
@@ -602,14 +635,16 @@ class HLA(object):
                                     # event_list.append(lla)
 
                                     ## if false detection flag enabled
+                                    if stats:
+                                        stats.count("errors", "lla")
+
                                     if lla_fd:
-                                        print "LLA " + self.active_lla + " is fucked up to ",
                                         ## generate a falsely detected LLA event according to "reasonable false positives" (see ADJACENCY dict for each LLA)
-                                        false_llas = LLA.LLA_ADJACENCY.get(self.active_lla)
-                                        if false_llas:
-                                            idx = random.randint(0, len(false_llas) - 1)
-                                            false_lla_type = false_llas[idx]
-                                            print false_lla_type
+                                        false_lla_type = tables.sample_false_lla(lla_idx, random.random())
+                                        if false_lla_type:
+                                            if stats:
+                                                stats.count("false_detects", "lla")
+                                                stats.count("false_detect_pairs", self.active_lla + " -> " + false_lla_type)
 
                                             cert = AtomicEvent.get_tp_certainty_value(DEFAULT_TP_MU, DEFAULT_TP_SIGMA)
                                             lla = LLA(type=false_lla_type, person=self.person, timestamp=ts_lla, certainty=cert)
@@ -651,6 +686,35 @@ class HLA(object):
 
 
 
+## (LLA, Position) combinations accepted for each defined HLA
+HLA_COMBINATIONS = {
+    HLA.WORKING:        [(LLA.SITTING, Position.WORK_AREA)],
+    HLA.DISCUSSING:     [(LLA.SITTING, Position.CONFERENCE_AREA), (LLA.STANDING, Position.CONFERENCE_AREA)],
+    HLA.DINING:         [(LLA.SITTING, Position.DINING_AREA)],
+    HLA.SNACKING:       [(LLA.STANDING, Position.DINING_AREA)],
+    HLA.ENTERTAINMENT:  [(LLA.SITTING, Position.ENTERTAINMENT_AREA), (LLA.STANDING, Position.ENTERTAINMENT_AREA)],
+    HLA.EXERCISING:     [(LLA.STANDING, Position.EXERCISE_AREA)],
+    HLA.HYGENE:         [(LLA.STANDING, Position.HYGENE_AREA), (LLA.WALKING, Position.HYGENE_AREA)],
+}
+
+_TABLES = None
+
+
+def vocabulary_tables():
+    '''
+    Integer-coded vocabulary, used for sampling and for generating the rule file; built on first use
+    :return: the VocabularyTables of the Positions, LLAs and HLAs
+    '''
+    global _TABLES
+    if _TABLES is None:
+        from .tables import VocabularyTables
+
+        _TABLES = VocabularyTables(Position.AREAS, LLA.TYPES, HLA.TYPES,
+                                   Position.AREA_ADJACENCY, LLA.LLA_ADJACENCY, HLA_COMBINATIONS)
+    return _TABLES
+
+
+
 """====================================================================================================================="""
 """=================================================== SPECIFIC HLAs ==================================================="""
 """====================================================================================================================="""
@@ -662,8 +726,7 @@ class WorkingHLA(HLA):
 
         super(WorkingHLA, self).__init__(type=HLA.WORKING, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations = [{"lla": LLA.SITTING, "position": Position.WORK_AREA}])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 class DiscussingHLA(HLA):
@@ -673,10 +736,7 @@ class DiscussingHLA(HLA):
 
         super(DiscussingHLA, self).__init__(type=HLA.DISCUSSING, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations=[{"lla": LLA.SITTING, "position": Position.CONFERENCE_AREA},
-                                                                {"lla": LLA.STANDING, "position": Position.CONFERENCE_AREA}
-                                                                ])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 class DiningHLA(HLA):
@@ -686,8 +746,7 @@ class DiningHLA(HLA):
 
         super(DiningHLA, self).__init__(type=HLA.DINING, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations = [{"lla": LLA.SITTING, "position": Position.DINING_AREA}])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 class SnackingHLA(HLA):
@@ -697,8 +756,7 @@ class SnackingHLA(HLA):
 
         super(SnackingHLA, self).__init__(type=HLA.SNACKING, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations = [{"lla": LLA.STANDING, "position": Position.DINING_AREA}])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 class EntertainmentHLA(HLA):
@@ -708,9 +766,7 @@ class EntertainmentHLA(HLA):
 
         super(EntertainmentHLA, self).__init__(type=HLA.ENTERTAINMENT, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations = [{"lla": LLA.SITTING,  "position": Position.ENTERTAINMENT_AREA},
-                                                                  {"lla": LLA.STANDING, "position": Position.ENTERTAINMENT_AREA}])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 class ExerciseHLA(HLA):
@@ -720,8 +776,7 @@ class ExerciseHLA(HLA):
 
         super(ExerciseHLA, self).__init__(type=HLA.EXERCISING, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations = [{"lla": LLA.STANDING, "position": Position.EXERCISE_AREA}])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 
@@ -732,9 +787,7 @@ class HygeneHLA(HLA):
 
         super(HygeneHLA, self).__init__(type=HLA.HYGENE, person=person,
                                          start_time=start_time, duration=duration,
-                                         lla_step=lla_step, pos_step=pos_step,
-                                         accepted_combinations = [{"lla": LLA.STANDING, "position": Position.HYGENE_AREA},
-                                                                  {"lla": LLA.WALKING,  "position": Position.HYGENE_AREA}])
+                                         lla_step=lla_step, pos_step=pos_step)
 
 
 
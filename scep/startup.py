@@ -0,0 +1,80 @@
+'''
+Startup-time benchmark of the scep core: imports the core modules in fresh interpreters, and checks that the import
+stays under a time budget and loads none of the heavy dependencies (NumPy, SciPy, matplotlib, pytz).
+
+    python -m scep.startup [--runs N] [--budget-ms MS] [--python PYTHON]
+
+The exit status is 1 when the median import time is over the budget or a heavy dependency is loaded.
+'''
+from __future__ import print_function
+
+import argparse, json, os, subprocess, sys
+
+CORE_MODULES = ("scep", "scep.events", "scep.streams")
+HEAVY_MODULES = ("numpy", "scipy", "matplotlib", "pytz")
+
+DEFAULT_RUNS = 10
+DEFAULT_BUDGET_MS = 100.0
+
+## run in the measured interpreter: the import time of the core, and the heavy modules it loaded
+PROBE = """
+import json, sys, timeit
+start = timeit.default_timer()
+%s
+seconds = timeit.default_timer() - start
+print(json.dumps({"seconds": seconds, "heavy": sorted(name for name in %r if name in sys.modules)}))
+"""
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def measure(python = sys.executable, modules = CORE_MODULES):
+    '''
+    Import the modules in a fresh interpreter
+    :return: (import seconds, list of heavy modules loaded)
+    '''
+    probe = PROBE % ("\n".join("import " + module for module in modules), HEAVY_MODULES)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.abspath(ROOT) + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    output = subprocess.check_output([python, "-c", probe], env=env, cwd=os.path.abspath(ROOT))
+    result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+    return result["seconds"], result["heavy"]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Check the import time of the scep core.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="fresh interpreters to measure")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="maximum median import time (default: %(default)s)")
+    parser.add_argument("--python", default=sys.executable, help="interpreter to measure (default: this one)")
+    args = parser.parse_args(argv)
+
+    ## warm-up run, so that the measured runs do not compile the modules
+    measure(args.python)
+
+    timings = []
+    heavy = set()
+    for _ in range(args.runs):
+        seconds, loaded = measure(args.python)
+        timings.append(seconds * 1000.0)
+        heavy.update(loaded)
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print("import %s: median %.1f ms, min %.1f ms, max %.1f ms over %d runs (budget %.0f ms)" % (
+        ", ".join(CORE_MODULES), median, timings[0], timings[-1], len(timings), args.budget_ms))
+
+    failed = False
+    if median > args.budget_ms:
+        print("over budget", file=sys.stderr)
+        failed = True
+    if heavy:
+        print("heavy dependencies loaded by the core: " + ", ".join(sorted(heavy)), file=sys.stderr)
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
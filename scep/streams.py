@@ -0,0 +1,118 @@
+'''
+Reading and writing of ETALIS event stream files, shared by the stream tools.
+The parser is lenient: lines that are not events (comments, sleep(N) statements, blank lines) are passed through or
+skipped by the callers, and a missing closing parenthesis (as in the first line of output.stream) is tolerated.
+'''
+import calendar, datetime, math, re
+
+EVENT_REGEX = re.compile(r"^\s*event\(\s*(?P<type>\w+)\(\s*(?P<person>[^,()\s]+)\s*,\s*(?P<value>[^,()\s]+)\s*,"
+                         r"\s*meta\(\s*(?P<last_update>[^,()\s]+)\s*,\s*(?P<certainty>[^,()\s]+)\s*\)\s*\)\s*,"
+                         r"\s*\[\s*(?P<start>datime\([^)]*\)|[^,\]\s]+)\s*,\s*(?P<end>datime\([^)]*\)|[^,\]\s]+)\s*\]")
+
+DATIME_REGEX = re.compile(r"datime\(([^)]*)\)")
+
+## parsed times, by text: the start of an interval repeats in every derivation the engine outputs for it
+_TIME_CACHE = {}
+_TIME_CACHE_SIZE = 4096
+
+
+def parse_time(text):
+    '''
+    Convert an ETALIS time to seconds since the epoch. datime(Y,M,D,h,m,s,c) terms are read as UTC, the counter c being
+    the thousandths (as datime_to_timestamp/2 in patch/utils.P); plain numbers are already timestamps.
+    :param text: datime term or number, as text
+    :return: timestamp (float)
+    '''
+    timestamp = _TIME_CACHE.get(text)
+    if timestamp is not None:
+        return timestamp
+
+    match = DATIME_REGEX.match(text.strip())
+    if not match:
+        return float(text)
+
+    fields = [int(token) for token in match.group(1).split(",")]
+    year, month, day, hour, minute, second = fields[:6]
+    counter = fields[6] if len(fields) > 6 else 0
+
+    timestamp = calendar.timegm((year, month, day, hour, minute, second)) + counter / 1000.0
+    if len(_TIME_CACHE) >= _TIME_CACHE_SIZE:
+        _TIME_CACHE.clear()
+    _TIME_CACHE[text] = timestamp
+
+    return timestamp
+
+
+def format_time(timestamp):
+    '''
+    Convert seconds since the epoch back to an ETALIS datime term
+    :param timestamp: timestamp (float)
+    :return: datime term, as text
+    '''
+    seconds = int(math.floor(timestamp))
+    counter = int(round((timestamp - seconds) * 1000))
+    ts = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+
+    return "datime(%d,%d,%d,%d,%d,%d,%d)" % (ts.year, ts.month, ts.day, ts.hour, ts.minute, ts.second, counter)
+
+
+class StreamEvent(object):
+    '''
+    One pos/lla/hla event of a stream: type(person, value, meta(last_update, certainty)) over [start, end]
+    '''
+    def __init__(self, type, person, value, last_update, certainty, start, end, line = None):
+        self.type = type
+        self.person = person
+        self.value = value
+        self.last_update = last_update
+        self.certainty = certainty
+        self.start = start
+        self.end = end
+        ## original stream line, if the event was read from a stream
+        self.line = line
+
+    @property
+    def key(self):
+        return (self.type, self.person, self.value)
+
+    def to_etalis(self):
+        '''
+        Generate the event in ETALIS stream form
+        :return:
+        '''
+        return "event(%s(%s,%s,meta(%r,%r)),[%s,%s])." % (self.type, self.person, self.value,
+                                                        self.last_update, self.certainty,
+                                                        format_time(self.start), format_time(self.end))
+
+    def __repr__(self):
+        return "StreamEvent(%s)" % self.to_etalis()
+
+
+def parse_event(line):
+    '''
+    Parse one stream line
+    :param line: stream line
+    :return: a StreamEvent, or None if the line is not an event
+    '''
+    match = EVENT_REGEX.match(line)
+    if not match:
+        return None
+
+    try:
+        return StreamEvent(match.group("type"), match.group("person"), match.group("value"),
+                           float(match.group("last_update")), float(match.group("certainty")),
+                           parse_time(match.group("start")), parse_time(match.group("end")),
+                           line=line.rstrip("\r\n"))
+    except ValueError:
+        return None
+
+
+def read_events(lines):
+    '''
+    Iterate over the events of a stream, skipping every other line
+    :param lines: iterable of stream lines (e.g. an open file)
+    '''
+    for line in lines:
+        event = parse_event(line)
+        if event is not None:
+            yield event
@@ -0,0 +1,123 @@
+'''
+Integer-coded tables of the generator vocabulary: Positions, LLAs and HLAs are indexed once, the adjacency lists and
+the accepted (LLA, Position) combinations of the HLAs become NumPy arrays with cumulative probability rows, so that
+sampling a combination or a false detection is a searchsorted / array lookup instead of dict and list operations.
+
+The tables are built by events.vocabulary_tables() from the class constants, on first use, and are also what the rule
+file is generated from, so that the generator and the ETALIS rules use the same vocabulary.
+'''
+import numpy as np
+
+NONE = -1
+
+
+def cumulative_rows(weights):
+    '''
+    Row-normalized cumulative sums of a 2D weight array; all-zero rows stay zero
+    '''
+    weights = np.asarray(weights, dtype=float)
+    totals = weights.sum(axis=1)
+    totals[totals == 0] = 1.0
+    cumulative = np.cumsum(weights / totals[:, np.newaxis], axis=1)
+
+    ## no rounding gap at the top of a row: a sample in [0, 1) always falls on a positive weight
+    for row, weight_row in zip(cumulative, weights):
+        positive = np.nonzero(weight_row)[0]
+        if len(positive):
+            row[positive[-1]:] = 1.0
+
+    return cumulative
+
+
+class VocabularyTables(object):
+    '''
+    :param positions: Position types, in index order
+    :param llas: LLA types, in index order
+    :param hlas: HLA types, in index order
+    :param area_adjacency: dict Position -> Positions it can be falsely detected as
+    :param lla_adjacency: dict LLA -> LLAs it can be falsely detected as
+    :param combinations: dict HLA -> list of accepted (LLA, Position) pairs
+    '''
+    def __init__(self, positions, llas, hlas, area_adjacency, lla_adjacency, combinations):
+        self.positions = tuple(positions)
+        self.llas = tuple(llas)
+        self.hlas = tuple(hlas)
+
+        self.position_index = dict((name, idx) for idx, name in enumerate(self.positions))
+        self.lla_index = dict((name, idx) for idx, name in enumerate(self.llas))
+        self.hla_index = dict((name, idx) for idx, name in enumerate(self.hlas))
+
+        ## adjacency[i, j] = 1 if type i can be falsely detected as type j; uniform over the adjacent types
+        self.area_adjacency = self._adjacency(area_adjacency, self.position_index)
+        self.lla_adjacency = self._adjacency(lla_adjacency, self.lla_index)
+        self.area_adjacency_cumulative = cumulative_rows(self.area_adjacency)
+        self.lla_adjacency_cumulative = cumulative_rows(self.lla_adjacency)
+
+        ## combinations[h] = int array of (lla index, position index) rows, chosen uniformly
+        self.combinations = [np.zeros((0, 2), dtype=np.int32) for _ in self.hlas]
+        for hla, pairs in combinations.items():
+            self.combinations[self.hla_index[hla]] = np.array(
+                [(self.lla_index[lla], self.position_index[pos]) for lla, pos in pairs], dtype=np.int32).reshape(-1, 2)
+
+        ## combination_hla[position, lla] = index of the HLA accepting the combination, NONE if there is none
+        self.combination_hla = np.full((len(self.positions), len(self.llas)), NONE, dtype=np.int32)
+        for hla_idx, pairs in enumerate(self.combinations):
+            for lla_idx, pos_idx in pairs:
+                other_idx = self.combination_hla[pos_idx, lla_idx]
+                if other_idx not in (NONE, hla_idx):
+                    raise ValueError("(%s, %s) is accepted by both HLAs %s and %s" % (
+                        self.llas[lla_idx], self.positions[pos_idx], self.hlas[other_idx], self.hlas[hla_idx]))
+                self.combination_hla[pos_idx, lla_idx] = hla_idx
+
+    @staticmethod
+    def _adjacency(adjacency, index):
+        table = np.zeros((len(index), len(index)), dtype=np.int8)
+        for name, adjacent in adjacency.items():
+            for other in adjacent:
+                table[index[name], index[other]] = 1
+        return table
+
+    @staticmethod
+    def _sample_row(cumulative, adjacency, idx, u):
+        if not adjacency[idx].any():
+            return NONE
+        return int(np.searchsorted(cumulative[idx], u, side="right"))
+
+    def sample_combination(self, hla, u):
+        '''
+        :param hla: HLA type
+        :param u: uniform sample in [0, 1)
+        :return: (LLA, Position) names, or None if the HLA accepts no combination
+        '''
+        pairs = self.combinations[self.hla_index[hla]]
+        if not len(pairs):
+            return None
+        lla_idx, pos_idx = pairs[int(u * len(pairs))]
+        return self.llas[lla_idx], self.positions[pos_idx]
+
+    def sample_false_position(self, pos_idx, u):
+        '''
+        :param pos_idx: index of the correct Position
+        :param u: uniform sample in [0, 1)
+        :return: name of a falsely detected Position, None if the Position has no adjacent ones
+        '''
+        idx = self._sample_row(self.area_adjacency_cumulative, self.area_adjacency, pos_idx, u)
+        return self.positions[idx] if idx != NONE else None
+
+    def sample_false_lla(self, lla_idx, u):
+        idx = self._sample_row(self.lla_adjacency_cumulative, self.lla_adjacency, lla_idx, u)
+        return self.llas[idx] if idx != NONE else None
+
+    def combinations_of(self, hla):
+        '''
+        :return: accepted combinations of an HLA, as list of {"lla": ..., "position": ...} dicts
+        '''
+        return [{"lla": self.llas[lla_idx], "position": self.positions[pos_idx]}
+                for lla_idx, pos_idx in self.combinations[self.hla_index[hla]]]
+
+    def hla_of(self, position, lla):
+        '''
+        :return: the HLA accepting the (LLA, Position) combination, None if there is none
+        '''
+        hla_idx = self.combination_hla[self.position_index[position], self.lla_index[lla]]
+        return self.hlas[hla_idx] if hla_idx != NONE else None
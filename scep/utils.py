@@ -1,5 +1,4 @@
 import math, datetime
-import numpy as np
 
 class GaussianPosTransition(object):
     DEFAULT_DELTA = 1
@@ -31,6 +30,8 @@ class GaussianPosTransition(object):
         self.distrib_func = GaussianPosTransition.gaussian(self.mean, self.sigma)
 
     def generate(self):
+        import numpy as np
+
         event_meta_list = []
 
         sec_diff = (self.end_time - self.start_time).total_seconds()
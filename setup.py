@@ -0,0 +1,15 @@
+from setuptools import setup
+
+## only the scep core is a package; the event-generator, stream-tools and plotter scripts import it once installed
+## (pip install -e .) and are run from their directories
+setup(
+    name="scep-activity-recognition",
+    version="0.1.0",
+    description="Activity recognition over ETALIS event streams: event model and stream parser",
+    packages=["scep"],
+    install_requires=[],
+    extras_require={
+        "generator": ["numpy"],
+        "plot": ["numpy", "matplotlib"],
+    },
+)
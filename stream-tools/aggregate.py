@@ -0,0 +1,183 @@
+'''
+Pre-aggregation of atomic pos/lla readings into validity intervals, in front of the engine.
+
+The interval extension of r_pos_1/r_pos_2 (resp. r_lla_1/r_lla_2) is done in Python, with the thresholds and the
+score_compute_flag of the rule file, per (person, type, value):
+
+- two successive readings, both above <type>_score_valid_threshold and with a score difference below
+  <type>_score_diff_threshold, open an interval from the first to the second (r_pos_1), unless an interval already
+  ends at the first one;
+- a valid reading at most <type>_max_rule_window seconds after the end of the open interval, with a score difference
+  below the threshold, extends it (r_pos_2);
+- the interval score is aggr_score of the interval and reading scores (mean or min), the last update is the reading's.
+
+By default an interval is forwarded once it can no longer be extended (the stream is past its end by the rule
+window), so the engine receives one event per interval instead of one per reading; with --emit every, each extension
+is forwarded as the engine would derive it. The atomic pos/lla readings themselves are not forwarded, other lines are.
+'''
+from __future__ import print_function
+
+import argparse, heapq, os, re, sys
+
+from scep import streams
+from engine import DEFAULT_RULES
+from prefilter import load_thresholds
+
+AGGREGATED_TYPES = ("pos", "lla")
+
+SCORE_FLAG_REGEX = re.compile(r"^\s*score_compute_flag\(\s*(\w+)\s*\)\s*\.", re.MULTILINE)
+
+AGGR_SCORE = {
+    "mean": lambda score1, score2: (score1 + score2) / 2.0,
+    "min":  min,
+}
+
+
+def load_score_compute_flag(rules_file = DEFAULT_RULES):
+    with open(rules_file) as infile:
+        match = SCORE_FLAG_REGEX.search(infile.read())
+
+    return match.group(1) if match else "mean"
+
+
+class _Interval(object):
+    __slots__ = ("event", "emitted")
+
+    def __init__(self, event):
+        self.event = event
+        self.emitted = False
+
+
+class Aggregator(object):
+    '''
+    Streaming aggregation: push() the stream lines in timestamp order, it returns the lines to forward;
+    flush() returns the intervals still open at the end of the stream
+    '''
+    def __init__(self, thresholds, score_compute_flag = "mean", emit_every = False):
+        self.thresholds = dict((type, thresholds[type]) for type in AGGREGATED_TYPES if type in thresholds)
+        self.aggr_score = AGGR_SCORE[score_compute_flag]
+        self.emit_every = emit_every
+        self.open = {}
+        self.previous = {}
+        ## end of the last interval derived per key, kept after the interval expires, for the fnot of r_pos_1
+        self.last_end = {}
+        self.expiry_heap = []
+        self.seq = 0
+        self.readings = 0
+        self.intervals = 0
+        self.emitted = 0
+
+    def push(self, line):
+        event = streams.parse_event(line)
+        if event is None:
+            return [line]
+        if event.type not in self.thresholds or event.start != event.end:
+            return [line] + self._expire(event.end)
+
+        self.readings += 1
+        thresholds = self.thresholds[event.type]
+        valid = event.certainty > thresholds["score_valid_threshold"]
+        diff = thresholds["score_diff_threshold"]
+        window = thresholds["max_rule_window"]
+
+        key = event.key
+        interval = self.open.get(key)
+        previous = self.previous.get(key)
+        self.previous[key] = event
+
+        derived = None
+        if valid and interval is not None and 0 < event.end - interval.event.end <= window \
+                and abs(interval.event.certainty - event.certainty) < diff:
+            ## r_pos_2: extend the open interval
+            derived = self._derive(interval.event.start, event, interval.event.certainty)
+        elif valid and previous is not None and previous.certainty > thresholds["score_valid_threshold"] \
+                and previous.end < event.end and abs(previous.certainty - event.certainty) < diff \
+                and self.last_end.get(key) != previous.end:
+            ## r_pos_1: open a new interval from the previous reading
+            derived = self._derive(previous.end, event, previous.certainty)
+
+        lines = []
+        if derived is not None:
+            self.last_end[key] = derived.end
+            if interval is not None and not self.emit_every and derived.start != interval.event.start:
+                ## a new interval replaces the open one, which is final
+                lines.append(self._emit(interval))
+            interval = self.open[key] = _Interval(derived)
+            if self.emit_every:
+                lines.append(self._emit(interval))
+            else:
+                heapq.heappush(self.expiry_heap, (derived.end + window, self.seq, key, interval))
+                self.seq += 1
+
+        return lines + self._expire(event.end)
+
+    def _derive(self, start, event, score):
+        self.intervals += 1
+        return streams.StreamEvent(event.type, event.person, event.value, event.last_update,
+                                   self.aggr_score(score, event.certainty), start, event.end)
+
+    def _emit(self, interval):
+        interval.emitted = True
+        self.emitted += 1
+        return interval.event.to_etalis()
+
+    def _expire(self, now):
+        lines = []
+        while self.expiry_heap and (now is None or self.expiry_heap[0][0] < now):
+            _, _, key, interval = heapq.heappop(self.expiry_heap)
+            if self.open.get(key) is interval:
+                del self.open[key]
+                if not interval.emitted:
+                    lines.append(self._emit(interval))
+
+        return lines
+
+    def flush(self):
+        if self.emit_every:
+            return []
+        return self._expire(None)
+
+
+def aggregate(lines, output, thresholds, score_compute_flag = "mean", emit_every = False):
+    '''
+    Aggregate the readings of a stream
+    :return: the Aggregator, for its counters
+    '''
+    aggregator = Aggregator(thresholds, score_compute_flag, emit_every)
+    for line in lines:
+        for forwarded in aggregator.push(line.rstrip("\r\n")):
+            output.write(forwarded + "\n")
+    for forwarded in aggregator.flush():
+        output.write(forwarded + "\n")
+
+    return aggregator
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Aggregate atomic pos/lla readings into validity intervals.")
+    parser.add_argument("input", help="input event stream, in timestamp order")
+    parser.add_argument("output", nargs="?", default=None, help="aggregated stream (default: stdout)")
+    parser.add_argument("--rules", default=DEFAULT_RULES, help="rule file the thresholds are read from")
+    parser.add_argument("--emit", choices=["final", "every"], default="final",
+                        help="forward final intervals only, or every extension (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rules = os.path.abspath(args.rules)
+    thresholds = load_thresholds(rules)
+    score_compute_flag = load_score_compute_flag(rules)
+
+    with open(args.input) as infile:
+        if args.output:
+            with open(args.output, "w") as outfile:
+                aggregator = aggregate(infile, outfile, thresholds, score_compute_flag, args.emit == "every")
+        else:
+            aggregator = aggregate(infile, sys.stdout, thresholds, score_compute_flag, args.emit == "every")
+
+    print("%d readings aggregated into %d interval events (%d extensions)" % (
+        aggregator.readings, aggregator.emitted, aggregator.intervals), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+'''
+End-to-end throughput benchmark: generates parameterized workloads with the event-generator HLAs, runs the engine
+over each of them and records throughput, peak memory, per-event latency and output counts in a JSON results file.
+A previous results file can be given as baseline, to report the regressions of the current run.
+'''
+from __future__ import print_function, division
+
+import argparse, datetime, itertools, json, os, random, sys, tempfile
+
+import numpy as np
+
+from scep import events
+
+from engine import Engine, parse_flags, DEFAULT_RULES, DEFAULT_ETALIS, DEFAULT_SWIPL, HLA_PATTERN
+
+WORKLOAD_START = datetime.datetime(2016, 6, 13, 15, 42, 28)
+
+## defined HLAs each person goes through, separated by UNDEFINED transitions
+HLA_CYCLE = [events.WorkingHLA, events.DiningHLA, events.WorkingHLA, events.SnackingHLA, events.EntertainmentHLA]
+
+DEFAULT_HLA_DURATION        = 60
+DEFAULT_TRANSITION_DURATION = 10
+
+## metrics compared against the baseline: name -> True if higher is better
+REGRESSION_METRICS = {
+    "events_per_sec":   True,
+    "latency_p95_us":   False,
+    "peak_rss_kb":      False,
+}
+
+
+class Workload(object):
+    '''
+    One benchmark workload: number of persons x stream duration (in seconds) x LLA/Position update step x detection error rates
+    '''
+    def __init__(self, persons, duration, step, error_rate, false_detect_rate, seed = 0):
+        self.persons = persons
+        self.duration = duration
+        self.step = step
+        self.error_rate = error_rate
+        self.false_detect_rate = false_detect_rate
+        self.seed = seed
+
+    @property
+    def key(self):
+        return "p%d_d%d_s%g_er%g_fd%g" % (self.persons, self.duration, self.step, self.error_rate, self.false_detect_rate)
+
+    def to_dict(self):
+        return {
+            "persons": self.persons,
+            "duration": self.duration,
+            "step": self.step,
+            "error_rate": self.error_rate,
+            "false_detect_rate": self.false_detect_rate,
+            "seed": self.seed
+        }
+
+    def person_hla_list(self, person):
+        '''
+        Chain UNDEFINED transitions and defined HLAs for one person until the workload duration is covered
+        :param person: name of the person
+        :return: list of HLAs
+        '''
+        hla_list = []
+        start = WORKLOAD_START
+        end = WORKLOAD_START + datetime.timedelta(seconds=self.duration)
+
+        for hla_class in itertools.cycle(HLA_CYCLE):
+            if start >= end:
+                break
+
+            undef_hla = events.UndefinedHLA(person=person, start_time=start, duration=DEFAULT_TRANSITION_DURATION,
+                                            lla_step=self.step, pos_step=self.step)
+            if hla_list:
+                undef_hla.preceded_by = hla_list[-1]
+
+            start += datetime.timedelta(seconds=DEFAULT_TRANSITION_DURATION + 2 * events.DEFAULT_NON_OVERLAP_DURATION)
+            hla = hla_class(person=person, start_time=start, duration=DEFAULT_HLA_DURATION,
+                            lla_step=self.step, pos_step=self.step)
+            hla.lla_error_rate = hla.pos_error_rate = self.error_rate
+            hla.lla_false_detect_rate = hla.pos_false_detect_rate = self.false_detect_rate
+            hla.preceded_by = undef_hla
+
+            hla_list.extend([undef_hla, hla])
+            start += datetime.timedelta(seconds=DEFAULT_HLA_DURATION)
+
+        return hla_list
+
+    def generate(self, stream_file):
+        '''
+        Write the workload event stream, the events of all persons merged by timestamp
+        :param stream_file: output stream file
+        :return: number of events written
+        '''
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+
+        event_list = []
+        for idx in range(self.persons):
+            for hla in self.person_hla_list("person%d" % idx):
+                event_list.extend(hla.generate())
+
+        event_list.sort(key=lambda ev: ev.timestamp)
+
+        with open(stream_file, "w") as outfile:
+            for event in event_list:
+                outfile.write(event.to_etalis() + "\n")
+
+        return len(event_list)
+
+
+def percentile(sorted_values, pct):
+    '''
+    Nearest-rank percentile of an already sorted list
+    '''
+    if not sorted_values:
+        return None
+    rank = int(np.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def count_events(stream_file):
+    if not os.path.exists(stream_file):
+        return 0
+    with open(stream_file) as infile:
+        return sum(1 for line in infile if line.strip() and not line.startswith("%"))
+
+
+def run_workload(engine, workload, work_dir, sink_mode = "all"):
+    '''
+    Generate and run one workload
+    :return: the result record of the workload
+    '''
+    stream_file = os.path.join(work_dir, workload.key + ".stream")
+    output_file = os.path.join(work_dir, workload.key + ".hla_output.stream")
+    latency_file = os.path.join(work_dir, workload.key + ".latency")
+    log_file = os.path.join(work_dir, workload.key + ".log")
+
+    input_events = workload.generate(stream_file)
+    result = engine.run(stream_file, output_file, log_file,
+                        pattern=HLA_PATTERN, sink_mode=sink_mode, latency_file=latency_file)
+
+    record = workload.to_dict()
+    record.update({
+        "key": workload.key,
+        "ok": result.ok,
+        "input_events": input_events,
+        "output_events": count_events(output_file),
+        "wall_seconds": result.wall_seconds,
+        "stream_seconds": result.stream_seconds,
+        "peak_rss_kb": result.peak_rss_kb,
+        "preloaded": result.preloaded,
+    })
+
+    latencies = []
+    if os.path.exists(latency_file):
+        with open(latency_file) as infile:
+            latencies = sorted(int(line) for line in infile if line.strip())
+
+    record["events_per_sec"] = input_events / result.stream_seconds if result.stream_seconds else None
+    record["latency_mean_us"] = sum(latencies) / len(latencies) if latencies else None
+    for pct in (50, 95, 99):
+        record["latency_p%d_us" % pct] = percentile(latencies, pct)
+    record["latency_max_us"] = latencies[-1] if latencies else None
+
+    return record
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Compare the records of two benchmark runs, workload by workload
+    :param results: current results
+    :param baseline: baseline results
+    :param tolerance: relative change tolerated before a metric counts as a regression
+    :return: list of (key, metric, baseline value, current value, relative change, regression flag)
+    '''
+    baseline_runs = dict((run["key"], run) for run in baseline["runs"])
+
+    rows = []
+    for run in results["runs"]:
+        base = baseline_runs.get(run["key"])
+        if base is None:
+            continue
+
+        for metric, higher_is_better in sorted(REGRESSION_METRICS.items()):
+            old, new = base.get(metric), run.get(metric)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / float(old)
+            regression = change < -tolerance if higher_is_better else change > tolerance
+            rows.append((run["key"], metric, old, new, change, regression))
+
+    return rows
+
+
+def parse_list(text, cast):
+    return [cast(token) for token in text.split(",") if token.strip()]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Run the activity recognition rules over generated workloads.")
+    parser.add_argument("--persons", default="1,4", help="comma separated numbers of persons")
+    parser.add_argument("--duration", default="300", help="comma separated stream durations, in seconds")
+    parser.add_argument("--step", default="1", help="comma separated LLA/Position update steps, in seconds")
+    parser.add_argument("--error-rate", default="0.1", help="comma separated detection error rates")
+    parser.add_argument("--false-detect-rate", default="0.1", help="comma separated false detection rates")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flag", action="append", default=None, help="ETALIS flag as name=value (repeatable)")
+    parser.add_argument("--sink-mode", default="all",
+                        help="event sink mode: all (safe), maximal (exact, written at the end) or maximal(Horizon) "
+                             "(approximate, see open_event_sink/3)")
+    parser.add_argument("--rules", default=DEFAULT_RULES)
+    parser.add_argument("--etalis", default=DEFAULT_ETALIS)
+    parser.add_argument("--swipl", default=DEFAULT_SWIPL)
+    parser.add_argument("--image", default=None, help="saved engine state to start from, when fresh (see engine.py)")
+    parser.add_argument("--work-dir", default=None, help="directory for the generated streams and engine logs")
+    parser.add_argument("--output", default="benchmark-results.json", help="results file")
+    parser.add_argument("--baseline", default=None, help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change tolerated by the comparison")
+    args = parser.parse_args(argv)
+
+    flags = parse_flags(args.flag) if args.flag else None
+    engine = Engine(rules=os.path.abspath(args.rules), etalis=os.path.abspath(args.etalis), flags=flags, swipl=args.swipl,
+                    image=args.image)
+
+    ## swipl runs in the rules directory: the paths passed to it are absolute
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="scep-benchmark-")
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    workloads = [Workload(p, d, s, er, fd, args.seed) for p, d, s, er, fd in itertools.product(
+        parse_list(args.persons, int), parse_list(args.duration, int), parse_list(args.step, float),
+        parse_list(args.error_rate, float), parse_list(args.false_detect_rate, float))]
+
+    results = {
+        "created": datetime.datetime.now().isoformat(),
+        "engine": {"rules": engine.rules, "flags": engine.flags, "sink_mode": args.sink_mode, "image": engine.image},
+        "runs": []
+    }
+
+    for workload in workloads:
+        record = run_workload(engine, workload, work_dir, args.sink_mode)
+        results["runs"].append(record)
+        print("%-32s ok=%-5s events=%-8d out=%-6d events/s=%-10s p95(us)=%-8s rss(kB)=%s" % (
+            record["key"], record["ok"], record["input_events"], record["output_events"],
+            "%.1f" % record["events_per_sec"] if record["events_per_sec"] else "-",
+            record["latency_p95_us"] if record["latency_p95_us"] is not None else "-",
+            record["peak_rss_kb"] if record["peak_rss_kb"] is not None else "-"))
+        if not record["ok"]:
+            print("    engine failed, see " + os.path.join(work_dir, workload.key + ".log"))
+
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
+    print("Results written to " + args.output + " (streams and logs in " + work_dir + ")")
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+
+        regressions = 0
+        for key, metric, old, new, change, regression in compare(results, baseline, args.tolerance):
+            regressions += regression
+            print("%-32s %-16s %12.1f -> %12.1f  %+6.1f%%%s" % (key, metric, old, new, 100 * change,
+                                                               "  REGRESSION" if regression else ""))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
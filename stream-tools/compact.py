@@ -0,0 +1,149 @@
+'''
+Maximal-interval compaction of an hla output stream. The engine emits every refinement of an activity interval
+(e.g. hla(mihai,working,...) over [15:42:42, 15:42:43], then [15:42:42, 15:42:44], ...); the compaction keeps, for each
+(type, person, activity, start), only the refinement with the latest end, and drops the intervals contained in another
+interval of the same (type, person, activity), e.g. a working interval starting inside a longer one with the same end.
+
+By default every interval is held until the end of the stream, which is exact: r_hla_7 joins an interval with the
+next one of the same activity starting within hla_max_gap of its end, and re-derives the join each time that next
+interval grows, so an interval can be extended for as long as the activity goes on, however long ago it ended. Memory
+is bounded by the number of intervals, not of refinements.
+
+With a horizon, a refinement is written once the stream has moved more than `horizon` seconds past its end. This bounds
+memory by the events of the last horizon seconds, but an interval extended later is written again with the same start,
+and containment is only checked among the intervals still held at the end, so the output is not maximal. The engine
+can also do this in its output path, see the maximal and maximal(Horizon) modes of open_event_sink/3 in patch/utils.P.
+'''
+from __future__ import print_function
+
+import argparse, collections, heapq, sys
+
+from scep import streams
+
+## None: unbounded, exact
+DEFAULT_HORIZON = None
+
+
+class Compactor(object):
+    '''
+    Streaming compaction: feed the events in stream order with push(), then collect the remaining ones with flush()
+    '''
+    def __init__(self, horizon = DEFAULT_HORIZON):
+        ## None means unbounded: everything is held until flush()
+        self.horizon = horizon
+        self.pending = {}
+        self.expiry_heap = []
+        self.watermark = None
+        self.seq = 0
+
+    def push(self, event):
+        '''
+        Add one event
+        :param event: streams.StreamEvent
+        :return: list of the maximal events that can no longer be refined
+        '''
+        key = event.key + (event.start,)
+        current = self.pending.get(key)
+        if current is None or event.end >= current.end:
+            self.pending[key] = event
+            if self.horizon is not None:
+                ## superseded heap entries are skipped when they expire
+                heapq.heappush(self.expiry_heap, (event.end, self.seq, key))
+                self.seq += 1
+
+        if self.watermark is None or event.end > self.watermark:
+            self.watermark = event.end
+
+        if self.horizon is None:
+            return []
+
+        return self._expire(self.watermark - self.horizon)
+
+    def _expire(self, limit):
+        expired = []
+        while self.expiry_heap and self.expiry_heap[0][0] < limit:
+            end, _, key = heapq.heappop(self.expiry_heap)
+            event = self.pending.get(key)
+            if event is not None and event.end == end:
+                del self.pending[key]
+                expired.append(event)
+
+        return expired
+
+    def flush(self):
+        '''
+        :return: the events still held back that are not contained in another one of them, ordered by end
+        '''
+        by_key = collections.defaultdict(list)
+        for event in self.pending.values():
+            by_key[event.key].append(event)
+
+        remaining = []
+        for events in by_key.values():
+            ## one event per start: an event is contained in an earlier starting one unless it ends later
+            events.sort(key=lambda ev: ev.start)
+            reach = None
+            for event in events:
+                if reach is None or event.end > reach:
+                    remaining.append(event)
+                    reach = event.end
+
+        remaining.sort(key=lambda ev: (ev.end, ev.start))
+        self.pending = {}
+        self.expiry_heap = []
+
+        return remaining
+
+
+def compact(lines, output, horizon = DEFAULT_HORIZON):
+    '''
+    Compact the events of a stream
+    :param lines: iterable of stream lines
+    :param output: file-like object receiving the maximal events
+    :return: number of events read and written
+    '''
+    compactor = Compactor(horizon)
+    read = written = 0
+
+    for event in streams.read_events(lines):
+        read += 1
+        for maximal in compactor.push(event):
+            output.write((maximal.line or maximal.to_etalis()) + "\n")
+            written += 1
+
+    for maximal in compactor.flush():
+        output.write((maximal.line or maximal.to_etalis()) + "\n")
+        written += 1
+
+    return read, written
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Collapse the refinements of an hla stream into maximal intervals.")
+    parser.add_argument("input", help="hla output stream")
+    parser.add_argument("output", nargs="?", default=None, help="compacted stream (default: stdout)")
+    parser.add_argument("--horizon", type=float, default=DEFAULT_HORIZON,
+                        help="write an interval once the stream is this many seconds past its end; bounds memory, but "
+                             "an interval extended later (e.g. by r_hla_7) is written again, so the output is NOT "
+                             "maximal (default: hold all intervals until the end of the stream, exact)")
+    parser.add_argument("--unbounded", action="store_true",
+                        help="hold all intervals until the end of the stream (the default, overrides --horizon)")
+    args = parser.parse_args(argv)
+
+    horizon = None if args.unbounded else args.horizon
+
+    with open(args.input) as infile:
+        if args.output:
+            with open(args.output, "w") as outfile:
+                read, written = compact(infile, outfile, horizon)
+        else:
+            read, written = compact(infile, sys.stdout, horizon)
+
+    print("%d events compacted to %d %sintervals" % (read, written, "" if horizon is not None else "maximal "),
+          file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
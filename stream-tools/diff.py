@@ -0,0 +1,223 @@
+'''
+Regression diff between two engine output streams (e.g. the hla_output.stream of two rule file or engine versions).
+
+The engine writes one event per derivation, so an HLA detected from T1 to T2 appears once per extension of its end.
+Each stream is first reduced to its detected intervals: of the events of a (person, value) starting at the same time,
+the one reaching furthest. The intervals of every (person, value) are then aligned with a sort-merge sweep over both
+streams, and each one is reported as:
+
+- matched:   same start and end (within the time tolerance) and certainty (within the certainty tolerance);
+- certainty: same start and end, but the certainty differs by more than the tolerance;
+- shifted:   overlapping an interval of the other stream, with a different start or end;
+- removed:   only in the old stream;
+- added:     only in the new stream.
+
+The reduction is a single pass with a dict, and the intervals of a stream are already nearly sorted, so the diff
+stays linear in the stream sizes. The exit status is 1 when there are differences, so the tool can gate benchmark runs.
+'''
+from __future__ import print_function
+
+import argparse, collections, json, sys
+
+from scep import streams
+
+DEFAULT_TIME_TOLERANCE = 1.0
+DEFAULT_CERTAINTY_TOLERANCE = 0.01
+
+MATCHED = "matched"
+CERTAINTY = "certainty"
+SHIFTED = "shifted"
+REMOVED = "removed"
+ADDED = "added"
+
+DIFFERENCE_KINDS = (ADDED, REMOVED, SHIFTED, CERTAINTY)
+
+
+class Interval(object):
+    __slots__ = ("start", "end", "certainty")
+
+    def __init__(self, start, end, certainty):
+        self.start = start
+        self.end = end
+        self.certainty = certainty
+
+    def __repr__(self):
+        return "[%s,%s] %.4f" % (streams.format_time(self.start), streams.format_time(self.end), self.certainty)
+
+
+def detected_intervals(lines, type = "hla"):
+    '''
+    Reduce a stream to its detected intervals
+    :param lines: iterable of stream lines
+    :param type: event type to keep
+    :return: dict (person, value) -> list of Intervals, sorted by start
+    '''
+    furthest = {}
+    for event in streams.read_events(lines):
+        if event.type != type:
+            continue
+        key = (event.person, event.value, event.start)
+        interval = furthest.get(key)
+        if interval is None:
+            furthest[key] = Interval(event.start, event.end, event.certainty)
+        elif event.end >= interval.end:
+            ## the last derivation reaching furthest holds the final certainty
+            interval.end = event.end
+            interval.certainty = event.certainty
+
+    intervals = collections.defaultdict(list)
+    for (person, value, _), interval in furthest.items():
+        intervals[(person, value)].append(interval)
+    for key_intervals in intervals.values():
+        key_intervals.sort(key=lambda interval: (interval.start, interval.end))
+
+    return intervals
+
+
+def align(old, new, time_tolerance = DEFAULT_TIME_TOLERANCE, certainty_tolerance = DEFAULT_CERTAINTY_TOLERANCE):
+    '''
+    Sort-merge sweep of the intervals of one (person, value) in both streams
+    :param old: Intervals of the old stream, sorted by start
+    :param new: Intervals of the new stream, sorted by start
+    :return: generator of (kind, old Interval or None, new Interval or None)
+    '''
+    i = j = 0
+    while i < len(old) and j < len(new):
+        a, b = old[i], new[j]
+        if a.end + time_tolerance < b.start:
+            yield REMOVED, a, None
+            i += 1
+        elif b.end + time_tolerance < a.start:
+            yield ADDED, None, b
+            j += 1
+        else:
+            if abs(a.start - b.start) > time_tolerance or abs(a.end - b.end) > time_tolerance:
+                kind = SHIFTED
+            elif abs(a.certainty - b.certainty) > certainty_tolerance:
+                kind = CERTAINTY
+            else:
+                kind = MATCHED
+            yield kind, a, b
+            i += 1
+            j += 1
+
+    for a in old[i:]:
+        yield REMOVED, a, None
+    for b in new[j:]:
+        yield ADDED, None, b
+
+
+class DiffReport(object):
+    '''
+    Counts of the aligned intervals, the differences, and the certainty deltas of the intervals present in both streams
+    '''
+    def __init__(self, type = "hla"):
+        self.type = type
+        self.counts = collections.Counter()
+        self.counts_per_value = collections.defaultdict(collections.Counter)
+        self.differences = []
+        self.certainty_deltas = 0
+        self.certainty_delta_sum = 0.0
+        self.certainty_delta_max = 0.0
+
+    def add(self, person, value, kind, old, new):
+        self.counts[kind] += 1
+        self.counts_per_value[value][kind] += 1
+        if old is not None and new is not None:
+            delta = abs(new.certainty - old.certainty)
+            self.certainty_deltas += 1
+            self.certainty_delta_sum += delta
+            self.certainty_delta_max = max(self.certainty_delta_max, delta)
+        if kind != MATCHED:
+            self.differences.append((kind, person, value, old, new))
+
+    @property
+    def certainty_delta_mean(self):
+        return self.certainty_delta_sum / self.certainty_deltas if self.certainty_deltas else 0.0
+
+    @property
+    def has_differences(self):
+        return bool(self.differences)
+
+    def format_difference(self, difference):
+        kind, person, value, old, new = difference
+        name = "%s(%s,%s)" % (self.type, person, value)
+        if kind == REMOVED:
+            return "%-9s %s %r" % (kind, name, old)
+        if kind == ADDED:
+            return "%-9s %s %r" % (kind, name, new)
+        if kind == CERTAINTY:
+            return "%-9s %s %r -> %.4f (%+.4f)" % (kind, name, old, new.certainty, new.certainty - old.certainty)
+
+        return "%-9s %s %r -> %r (start %+.3fs, end %+.3fs)" % (kind, name, old, new,
+                                                               new.start - old.start, new.end - old.end)
+
+    def to_dict(self):
+        return {
+            "type": self.type,
+            "counts": dict((kind, self.counts[kind]) for kind in (MATCHED,) + DIFFERENCE_KINDS),
+            "counts_per_value": dict((value, dict(counts)) for value, counts in self.counts_per_value.items()),
+            "certainty_delta": {
+                "mean": self.certainty_delta_mean,
+                "max": self.certainty_delta_max,
+            },
+            "differences": [self.format_difference(difference) for difference in self.differences],
+        }
+
+
+def diff_streams(old_lines, new_lines, type = "hla", time_tolerance = DEFAULT_TIME_TOLERANCE,
+                 certainty_tolerance = DEFAULT_CERTAINTY_TOLERANCE):
+    '''
+    Diff the detected intervals of two streams
+    :return: a DiffReport
+    '''
+    old = detected_intervals(old_lines, type)
+    new = detected_intervals(new_lines, type)
+
+    report = DiffReport(type)
+    for key in sorted(set(old) | set(new)):
+        person, value = key
+        for kind, old_interval, new_interval in align(old.get(key, []), new.get(key, []),
+                                                      time_tolerance, certainty_tolerance):
+            report.add(person, value, kind, old_interval, new_interval)
+
+    return report
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Diff the detected intervals of two engine output streams.")
+    parser.add_argument("old", help="reference output stream")
+    parser.add_argument("new", help="output stream to compare")
+    parser.add_argument("--type", default="hla", help="event type to compare (default: %(default)s)")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE,
+                        help="seconds an interval start or end may move (default: %(default)s)")
+    parser.add_argument("--certainty-tolerance", type=float, default=DEFAULT_CERTAINTY_TOLERANCE,
+                        help="certainty change below which intervals match (default: %(default)s)")
+    parser.add_argument("--max-print", type=int, default=50, help="differences to print, -1 for all")
+    parser.add_argument("--report", default=None, help="JSON file receiving the full diff report")
+    args = parser.parse_args(argv)
+
+    with open(args.old) as old_file:
+        with open(args.new) as new_file:
+            report = diff_streams(old_file, new_file, args.type, args.time_tolerance, args.certainty_tolerance)
+
+    printed = report.differences if args.max_print < 0 else report.differences[:args.max_print]
+    for difference in printed:
+        print(report.format_difference(difference))
+    if len(printed) < len(report.differences):
+        print("... %d more differences" % (len(report.differences) - len(printed)))
+
+    if args.report:
+        with open(args.report, "w") as outfile:
+            json.dump(report.to_dict(), outfile, indent=2, sort_keys=True)
+
+    print("%d matched, %d added, %d removed, %d shifted, %d certainty changes" % tuple(
+        report.counts[kind] for kind in (MATCHED, ADDED, REMOVED, SHIFTED, CERTAINTY)), file=sys.stderr)
+    print("certainty delta of common intervals: mean %.4f, max %.4f" % (
+        report.certainty_delta_mean, report.certainty_delta_max), file=sys.stderr)
+
+    return 1 if report.has_differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
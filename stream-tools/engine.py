@@ -0,0 +1,473 @@
+'''
+Driver for the SWI-Prolog/ETALIS engine, used by the stream tools to run the
+activity rules over an event stream file (see activity-test.sh.bat).
+
+Loading ETALIS and compiling the rules can be done once, into a saved state (qsave_program/2) used by the following
+runs: build it with `engine.py build-image IMAGE`, run with `engine.py run --image IMAGE ...` (or the --image option of
+the other stream tools). A stamp file next to the image records the digests of the rules and ETALIS sources and the
+flags it was built with; when they no longer match, the engine falls back to loading the sources.
+
+Long runs can be checkpointed (see execute_checkpointed_event_stream_file/3 in patch/utils.P): given a checkpoint
+file, the engine saves its state every checkpoint_interval events, and a restarted run of the same configuration over
+the same stream resumes from the last checkpoint, with the output truncated to what was written at that point.
+'''
+from __future__ import print_function
+
+import argparse, glob, hashlib, json, os, re, subprocess, sys, tempfile, time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+## the repository's ETALIS patches, copied over the ETALIS sources
+PATCH_DIR = os.path.join(REPO_DIR, "patch")
+
+DEFAULT_SWIPL   = os.environ.get("SWIPL", "swipl")
+DEFAULT_ETALIS  = os.environ.get("ETALIS", os.path.join(REPO_DIR, "..", "etalis-test", "etalis", "src", "etalis.P"))
+DEFAULT_RULES   = os.path.join(REPO_DIR, "activity-test.event")
+
+DEFAULT_FLAGS = [("event_consumption_policy", "recent")]
+
+HLA_PATTERN = "hla(_, _, meta(_, _))"
+
+STREAM_SECONDS_REGEX = re.compile(r"stream_seconds\(([0-9.eE+-]+)\)")
+CHECKPOINT_HEADER_REGEX = re.compile(r"^checkpoint_header\((\d+),(\d+),(\d+|none)\)\.")
+
+## a checkpoint writes every fact of the goal store and of the other dynamic predicates, so its cost grows with the
+## number of partial detections held by the engine, not with the interval: large intervals keep that cost rare, at the
+## price of a longer replay after a restart
+DEFAULT_CHECKPOINT_INTERVAL = 10000
+
+
+def prolog_atom(text):
+    '''
+    Quote a string as a Prolog atom
+    :param text: atom text (e.g. a file path)
+    :return: the quoted atom
+    '''
+    return "'" + text.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def file_digest(paths):
+    '''
+    SHA-1 digest of the names and contents of a list of files
+    '''
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as infile:
+            digest.update(infile.read())
+
+    return digest.hexdigest()
+
+
+def load_json(path):
+    '''
+    :return: the JSON content of path, None if it is missing or invalid
+    '''
+    try:
+        with open(path) as infile:
+            return json.load(infile)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def read_checkpoint_header(checkpoint_file):
+    '''
+    :return: (events, stream offset, sink size or None) of a checkpoint file, None if it has no valid header
+    '''
+    with open(checkpoint_file) as infile:
+        match = CHECKPOINT_HEADER_REGEX.match(infile.readline())
+    if not match:
+        return None
+
+    sink_size = None if match.group(3) == "none" else int(match.group(3))
+    return int(match.group(1)), int(match.group(2)), sink_size
+
+
+def parse_flags(flag_list):
+    '''
+    Parse ETALIS flags given as "name=value" strings
+    :param flag_list: list of "name=value" strings
+    :return: list of (name, value) pairs
+    '''
+    flags = []
+    for flag in flag_list or []:
+        name, sep, value = flag.partition("=")
+        if not sep or not name or not value:
+            raise ValueError("ETALIS flag must be given as name=value: " + flag)
+        flags.append((name.strip(), value.strip()))
+
+    return flags
+
+
+class EngineResult(object):
+    '''
+    Outcome of one engine run
+    '''
+    def __init__(self, returncode, wall_seconds, stream_seconds = None, peak_rss_kb = None, log_file = None,
+                 preloaded = False):
+        self.returncode = returncode
+        self.wall_seconds = wall_seconds
+        self.stream_seconds = stream_seconds
+        self.peak_rss_kb = peak_rss_kb
+        self.log_file = log_file
+        ## True if the run started from the saved state
+        self.preloaded = preloaded
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+class Engine(object):
+    '''
+    One configuration of the engine: the rule file, the ETALIS sources and the flags to set before compiling the rules.
+    The derived events matching the output pattern are streamed to the output file through the event sink.
+    If image is given, runs start from that saved state as long as it is fresh (see build_image).
+    '''
+    def __init__(self, rules = DEFAULT_RULES, etalis = DEFAULT_ETALIS, flags = None, swipl = DEFAULT_SWIPL, image = None):
+        self.rules = rules
+        self.etalis = etalis
+        ## the given flags override the defaults with the same name
+        names = [name for name, _ in flags or []]
+        self.flags = [flag for flag in DEFAULT_FLAGS if flag[0] not in names] + list(flags or [])
+        self.swipl = swipl
+        self.image = os.path.abspath(image) if image else None
+
+    @property
+    def stamp_file(self):
+        return self.image + ".stamp"
+
+    def stamp(self):
+        '''
+        What a saved state depends on: the rule file, the ETALIS sources, the repository's patches (which may not have
+        been copied over the sources yet) and the flags
+        '''
+        return {
+            "rules": os.path.abspath(self.rules),
+            "rules_digest": file_digest([self.rules]),
+            "etalis_digest": file_digest(glob.glob(os.path.join(os.path.dirname(os.path.abspath(self.etalis)), "*.P"))),
+            "patch_digest": file_digest(glob.glob(os.path.join(PATCH_DIR, "*.P"))),
+            "flags": self.flag_goals(),
+            "swipl": self.swipl,
+        }
+
+    def image_is_fresh(self):
+        if not self.image or not os.path.exists(self.image):
+            return False
+        return load_json(self.stamp_file) == json.loads(json.dumps(self.stamp()))
+
+    def preloaded(self):
+        '''
+        :return: True if the saved state can be used, otherwise the sources are loaded (with a warning if an image is
+                 configured)
+        '''
+        if not self.image:
+            return False
+        if self.image_is_fresh():
+            return True
+
+        print("engine: saved state %s is missing or stale, loading the sources" % self.image, file=sys.stderr)
+        return False
+
+    def build_image(self, image = None, log_file = None):
+        '''
+        Load ETALIS, set the flags and compile the rules, then save the engine state to the image file, with its stamp
+        :param image: image file (default: self.image)
+        :param log_file: file receiving the swipl output (default: discarded)
+        :return: an EngineResult
+        '''
+        self.image = os.path.abspath(image or self.image)
+        goals = ["[%s]" % prolog_atom(self.etalis)]
+        goals.extend(self.flag_goals())
+        goals.append("compile_events(%s)" % prolog_atom(self.rules))
+        goals.append("qsave_program(%s, [])" % prolog_atom(self.image))
+        goals.append("halt")
+        args = [self.swipl, "-q", "-g", ", ".join(goals) + ".", "-t", "halt(1)"]
+
+        if os.path.exists(self.stamp_file):
+            os.remove(self.stamp_file)
+
+        start = time.time()
+        with open(log_file or os.devnull, "w") as log:
+            returncode = subprocess.call(args, stdout=log, stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(self.rules)))
+
+        if returncode == 0 and os.path.exists(self.image):
+            with open(self.stamp_file, "w") as outfile:
+                json.dump(self.stamp(), outfile, indent=2, sort_keys=True)
+
+        return EngineResult(returncode, time.time() - start, log_file=log_file)
+
+    def command(self, goal, preloaded = False):
+        '''
+        :return: the swipl command line running goal, from the saved state if preloaded
+        '''
+        args = [self.swipl]
+        if preloaded:
+            args.extend(["-x", self.image])
+
+        return args + ["-q", "-g", goal, "-t", "halt(1)"]
+
+    def flag_goals(self):
+        names = [name for name, _ in self.flags]
+        goals = ["set_etalis_flag(%s,%s)" % (name, value) for name, value in self.flags]
+        if "event_sink" not in names:
+            goals.append("set_etalis_flag(event_sink,on)")
+
+        return goals
+
+    def setup_goals(self, output_file, pattern, sink_mode, preloaded = False, append = False):
+        '''
+        Goals loading ETALIS, setting the flags, opening the event sink and compiling the rules;
+        from a saved state, where the rules are already compiled, only the event sink is opened
+        '''
+        sink_goal = "%s(%s, %s, %s)" % ("append_event_sink" if append else "open_event_sink",
+                                        prolog_atom(output_file), pattern, sink_mode)
+        if preloaded:
+            return [sink_goal]
+
+        goals = ["[%s]" % prolog_atom(self.etalis)]
+        goals.extend(self.flag_goals())
+        goals.append(sink_goal)
+        goals.append("compile_events(%s)" % prolog_atom(self.rules))
+
+        return goals
+
+    def goal(self, stream_file, output_file, pattern = HLA_PATTERN, sink_mode = "all", latency_file = None,
+             preloaded = False, checkpoint_file = None, checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL,
+             resume = False, stop_after = None):
+        '''
+        Build the swipl goal that runs the rules over stream_file
+        :param stream_file: input event stream file
+        :param output_file: file receiving the derived events that match pattern
+        :param pattern: Prolog term selecting the derived events to write
+        :param sink_mode: "all", "maximal" or "maximal(Horizon)", approximate (see open_event_sink/3)
+        :param latency_file: if given, the per-event processing times are written to it
+        :param preloaded: if True, the goal runs from the saved state
+        :param checkpoint_file: if given, the engine state is saved to it every checkpoint_interval events, and
+                                restored from it when it exists
+        :param resume: if True, the output file is appended to (the run resumes from the checkpoint)
+        :param stop_after: if given, the checkpointed run stops after this many events, as an interrupted run would
+        :return: the goal, as a string
+        '''
+        goals = self.setup_goals(output_file, pattern, sink_mode, preloaded, append=resume)
+        goals.append("get_time(StreamStart)")
+        if checkpoint_file:
+            goals.append("execute_checkpointed_event_stream_file(%s, %s, %d, %s)" % (
+                prolog_atom(stream_file), prolog_atom(checkpoint_file), checkpoint_interval,
+                "none" if stop_after is None else "%d" % stop_after))
+        elif latency_file:
+            goals.append("execute_timed_event_stream_file(%s, %s)" % (prolog_atom(stream_file), prolog_atom(latency_file)))
+        elif ("numeric_timestamps", "on") in self.flags:
+            goals.append("execute_numeric_event_stream_file(%s)" % prolog_atom(stream_file))
+        else:
+            goals.append("execute_event_stream_file(%s)" % prolog_atom(stream_file))
+        goals.append("get_time(StreamEnd)")
+        goals.append("StreamSeconds is StreamEnd - StreamStart")
+        goals.append("format(user_error, 'stream_seconds(~w).~n', [StreamSeconds])")
+        goals.append("close_event_sink")
+        goals.append("halt")
+
+        return ", ".join(goals) + "."
+
+    def serve_goal(self, output_file, pattern = HLA_PATTERN, sink_mode = "all", preloaded = False):
+        '''
+        Build the swipl goal of a long running engine, reading micro-batches of events from its standard input
+        (see serve_event_stream/1 in patch/utils.P and gateway.py)
+        :param output_file: file receiving the derived events and the batch acknowledgements (e.g. /dev/fd/N of a pipe)
+        :return: the goal, as a string
+        '''
+        goals = self.setup_goals(output_file, pattern, sink_mode, preloaded)
+        goals.append("serve_event_stream(user_input)")
+        goals.append("close_event_sink")
+        goals.append("halt")
+
+        return ", ".join(goals) + "."
+
+    def prepare_checkpoint(self, checkpoint_file, stream_file, output_file):
+        '''
+        Decide if a run resumes from checkpoint_file, which it does if the checkpoint was written by a run of the same
+        configuration over the same stream; the output file is then truncated to its size at the checkpoint.
+        Otherwise a stale checkpoint is removed and the stamp of the new run is written.
+        :return: True if the run resumes
+        '''
+        stamp = self.stamp()
+        stamp["stream"] = os.path.abspath(stream_file)
+        stamp_file = checkpoint_file + ".stamp"
+
+        if os.path.exists(checkpoint_file):
+            header = read_checkpoint_header(checkpoint_file)
+            if header is not None and load_json(stamp_file) == json.loads(json.dumps(stamp)):
+                events, _, sink_size = header
+                if sink_size is not None and os.path.exists(output_file):
+                    with open(output_file, "r+") as outfile:
+                        outfile.truncate(sink_size)
+                print("engine: resuming from checkpoint %s, after %d events" % (checkpoint_file, events),
+                      file=sys.stderr)
+                return True
+
+            print("engine: checkpoint %s does not match this run, starting over" % checkpoint_file, file=sys.stderr)
+            os.remove(checkpoint_file)
+
+        with open(stamp_file, "w") as outfile:
+            json.dump(stamp, outfile, indent=2, sort_keys=True)
+
+        return False
+
+    def run(self, stream_file, output_file, log_file, **goal_args):
+        '''
+        Run the engine over stream_file, in a separate swipl process
+        :param stream_file: input event stream file
+        :param output_file: file receiving the derived events
+        :param log_file: file receiving the engine stdout and stderr
+        :param goal_args: extra arguments of :func:`goal <engine.Engine.goal>`
+        :return: an EngineResult
+        '''
+        checkpoint_file = goal_args.get("checkpoint_file")
+        if checkpoint_file:
+            goal_args["resume"] = self.prepare_checkpoint(checkpoint_file, stream_file, output_file)
+
+        preloaded = self.preloaded()
+        args = self.command(self.goal(stream_file, output_file, preloaded=preloaded, **goal_args), preloaded)
+
+        with open(log_file, "w") as log:
+            start = time.time()
+            proc = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.abspath(self.rules)))
+
+            peak_rss_kb = None
+            if hasattr(os, "wait4"):
+                ## wait4 reports the resource usage of this child only (ru_maxrss is in kilobytes on Linux)
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+                peak_rss_kb = usage.ru_maxrss
+            else:
+                proc.wait()
+
+            wall_seconds = time.time() - start
+
+        stream_seconds = None
+        with open(log_file) as log:
+            match = STREAM_SECONDS_REGEX.search(log.read())
+            if match:
+                stream_seconds = float(match.group(1))
+
+        if checkpoint_file and proc.returncode == 0 and goal_args.get("stop_after") is None:
+            ## the stream was processed to its end, a restart would not resume
+            for path in (checkpoint_file, checkpoint_file + ".stamp"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return EngineResult(proc.returncode, wall_seconds, stream_seconds, peak_rss_kb, log_file, preloaded)
+
+    def check_checkpoint(self, stream_file, work_dir, checkpoint_interval, stop_after = None, **goal_args):
+        '''
+        Check that a run interrupted after a checkpoint and resumed from it writes the same output as an uninterrupted
+        run: the checkpoint is taken mid-stream, with partial detections in the goal store, and the events between
+        the checkpoint and the interruption are derived again after the resume
+        :param stop_after: events before the interruption (default: half an interval after the first checkpoint)
+        :return: (True if the outputs are equal, message)
+        '''
+        if stop_after is None:
+            stop_after = checkpoint_interval + checkpoint_interval // 2
+        reference = os.path.join(work_dir, "uninterrupted.stream")
+        resumed = os.path.join(work_dir, "resumed.stream")
+        checkpoint_file = os.path.join(work_dir, "checkpoint.P")
+
+        runs = [(reference, {}),
+                (resumed, {"checkpoint_file": checkpoint_file, "checkpoint_interval": checkpoint_interval,
+                           "stop_after": stop_after}),
+                (resumed, {"checkpoint_file": checkpoint_file, "checkpoint_interval": checkpoint_interval})]
+        for idx, (output_file, args) in enumerate(runs):
+            args.update(goal_args)
+            result = self.run(stream_file, output_file, os.path.join(work_dir, "run%d.log" % idx), **args)
+            if not result.ok:
+                return False, "engine failed, see %s" % result.log_file
+            if idx == 1 and not os.path.exists(checkpoint_file):
+                return False, "no checkpoint after %d events, the stream is too short" % stop_after
+
+        with open(reference) as infile:
+            expected = infile.readlines()
+        with open(resumed) as infile:
+            actual = infile.readlines()
+        for line, (expected_line, actual_line) in enumerate(zip(expected, actual), 1):
+            if expected_line != actual_line:
+                return False, "outputs differ at line %d: %r != %r" % (line, expected_line, actual_line)
+        if len(expected) != len(actual):
+            return False, "outputs differ in length: %d != %d lines" % (len(expected), len(actual))
+
+        return True, "resumed output equal to the uninterrupted one (%d lines)" % len(expected)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Build a saved engine state, or run the rules over a stream.")
+    parser.add_argument("--rules", default=DEFAULT_RULES)
+    parser.add_argument("--etalis", default=DEFAULT_ETALIS)
+    parser.add_argument("--swipl", default=DEFAULT_SWIPL)
+    parser.add_argument("--flag", action="append", default=None, help="ETALIS flag as name=value (repeatable)")
+    parser.add_argument("--log", default=None, help="file receiving the engine output")
+    commands = parser.add_subparsers(dest="command")
+
+    build = commands.add_parser("build-image", help="compile the rules into a saved state")
+    build.add_argument("image", help="saved state file")
+
+    run = commands.add_parser("run", help="run the rules over a stream")
+    run.add_argument("stream", help="input event stream")
+    run.add_argument("output", help="file receiving the derived events")
+    run.add_argument("--image", default=None, help="saved state to start from, when fresh")
+    run.add_argument("--pattern", default=HLA_PATTERN, help="derived events to write (default: %(default)s)")
+    run.add_argument("--sink-mode", default="all",
+                     help="event sink mode: all (safe), maximal (exact, written at the end) or maximal(Horizon) "
+                          "(approximate, see open_event_sink/3)")
+    run.add_argument("--checkpoint", default=None, help="checkpoint file, resumed from when it exists")
+    run.add_argument("--checkpoint-interval", type=int, default=DEFAULT_CHECKPOINT_INTERVAL,
+                     help="events between checkpoints (default: %(default)s)")
+
+    check = commands.add_parser("check-checkpoint",
+                                help="check that a run interrupted after a checkpoint and resumed from it writes the "
+                                     "same output as an uninterrupted run")
+    check.add_argument("stream", help="input event stream")
+    check.add_argument("--pattern", default=HLA_PATTERN, help="derived events to write (default: %(default)s)")
+    check.add_argument("--sink-mode", default="all",
+                       help="event sink mode: all (safe), maximal (exact, written at the end) or maximal(Horizon) "
+                            "(approximate, see open_event_sink/3)")
+    check.add_argument("--checkpoint-interval", type=int, default=1000,
+                       help="events between checkpoints (default: %(default)s)")
+    check.add_argument("--stop-after", type=int, default=None,
+                       help="events before the interruption (default: half an interval after the first checkpoint)")
+    check.add_argument("--work-dir", default=None, help="directory receiving the outputs (default: a temporary one)")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.error("a command is required")
+
+    flags = parse_flags(args.flag) if args.flag else None
+    engine = Engine(rules=os.path.abspath(args.rules), etalis=os.path.abspath(args.etalis), flags=flags,
+                    swipl=args.swipl)
+
+    if args.command == "build-image":
+        result = engine.build_image(args.image, args.log)
+        print("saved state %s built in %.1fs" % (args.image, result.wall_seconds) if result.ok else
+              "saved state build failed" + (", see " + args.log if args.log else ""), file=sys.stderr)
+        return result.returncode
+
+    if args.command == "check-checkpoint":
+        work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="checkpoint-check-")
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        equal, message = engine.check_checkpoint(os.path.abspath(args.stream), work_dir, args.checkpoint_interval,
+                                                 args.stop_after, pattern=args.pattern, sink_mode=args.sink_mode)
+        print("%s: %s (%s)" % ("ok" if equal else "FAILED", message, work_dir), file=sys.stderr)
+        return 0 if equal else 1
+
+    engine.image = os.path.abspath(args.image) if args.image else None
+    result = engine.run(os.path.abspath(args.stream), os.path.abspath(args.output),
+                        args.log or os.path.abspath(args.output) + ".log",
+                        pattern=args.pattern, sink_mode=args.sink_mode,
+                        checkpoint_file=os.path.abspath(args.checkpoint) if args.checkpoint else None,
+                        checkpoint_interval=args.checkpoint_interval)
+    print("%s in %.2fs (%s)" % ("done" if result.ok else "engine failed", result.wall_seconds,
+                                "saved state" if result.preloaded else "sources"), file=sys.stderr)
+    return result.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+'''
+Ingestion gateway: accepts pos/lla readings from many concurrent local socket clients, micro-batches them into a
+long running engine process (see serve_event_stream/1 in patch/utils.P) and streams the derived hla events back to
+subscribers. Python 3.7+ only (asyncio).
+
+Clients connect to the unix socket (and/or a localhost TCP port) and send one reading per line, either in ETALIS
+stream form - event(pos(mihai,work_area,meta(1465831348.0,0.91)),[datime(...),datime(...)]). - or as JSON -
+{"type": "pos", "person": "mihai", "value": "work_area", "certainty": 0.91, "timestamp": 1465831348.0}. Each reading
+is validated and re-serialized before it reaches the engine, so clients cannot inject Prolog goals; invalid lines
+are answered with "error: ..." on the same connection. A client sending "subscribe" as its first line instead
+receives the derived events, one per line.
+
+Each batch is closed with batch_end(Id), which the engine acknowledges with batch_done(Id) on the event sink once the
+batch is processed. At most --max-pending batches are unacknowledged at any time; when the engine falls behind the
+batcher waits, the ingest queue fills up and the client connections stop being read (backpressure).
+Ingest latency (reception to write into the engine) and end-to-end latency (reception to acknowledgement) are
+reported periodically and at shutdown.
+'''
+import argparse, asyncio, collections, json, os, re, signal, subprocess, sys, time
+
+from scep import streams
+from engine import Engine, parse_flags, DEFAULT_RULES, DEFAULT_ETALIS, DEFAULT_SWIPL, HLA_PATTERN
+
+DEFAULT_SOCKET = "gateway.sock"
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_BATCH_INTERVAL = 0.05
+DEFAULT_MAX_PENDING = 4
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_SUBSCRIBER_QUEUE_SIZE = 10000
+
+READING_TYPES = ("pos", "lla")
+ATOM_REGEX = re.compile(r"^[a-z][A-Za-z0-9_]*$")
+BATCH_DONE_REGEX = re.compile(r"^batch_done\((\d+)\)\.$")
+SUBSCRIBE = "subscribe"
+
+## 9999-12-31 23:59:59 UTC, the last time a datime term can be formatted from
+MAX_TIMESTAMP = 253402300799.0
+
+
+def parse_reading(line, now = None):
+    '''
+    Parse and validate one reading sent by a client
+    :param line: reading, in ETALIS stream form or as a JSON object
+    :param now: timestamp of the readings without one (default: the current time)
+    :return: streams.StreamEvent
+    :raise ValueError: if the reading is invalid
+    '''
+    line = line.strip()
+    if line.startswith("{"):
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError("reading must be a JSON object")
+        try:
+            timestamp = float(data.get("timestamp", time.time() if now is None else now))
+            event = streams.StreamEvent(data["type"], data["person"], data["value"],
+                                        float(data.get("last_update", timestamp)), float(data.get("certainty", 1.0)),
+                                        timestamp, float(data.get("end", timestamp)))
+        except KeyError as error:
+            raise ValueError("missing field %s" % error)
+        except TypeError as error:
+            raise ValueError(str(error))
+    else:
+        event = streams.parse_event(line)
+        if event is None:
+            raise ValueError("not an event")
+
+    if event.type not in READING_TYPES:
+        raise ValueError("unsupported event type %r" % event.type)
+    for field in (event.person, event.value):
+        if not isinstance(field, str) or not ATOM_REGEX.match(field):
+            raise ValueError("invalid atom %r" % (field,))
+    ## comparisons with NaN are false, so non-finite values are rejected as well
+    for name, value in (("timestamp", event.start), ("end", event.end), ("last_update", event.last_update)):
+        if not 0.0 <= value <= MAX_TIMESTAMP:
+            raise ValueError("%s out of range: %r" % (name, value))
+    if not 0.0 <= event.certainty <= 1.0:
+        raise ValueError("certainty out of range: %r" % event.certainty)
+    if event.end < event.start:
+        raise ValueError("event ends before it starts")
+
+    return event
+
+
+class LatencyStats(object):
+    '''
+    Latency samples (in seconds); the percentiles are computed over the last `window` samples
+    '''
+    def __init__(self, window = 100000):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        values = sorted(self.samples)
+        if not values:
+            return None
+        rank = max(int(-(-pct * len(values) // 100)), 1)
+        return values[rank - 1]
+
+    def report(self):
+        if not self.count:
+            return "-"
+        return "p50 %.1fms p95 %.1fms p99 %.1fms max %.1fms" % tuple(
+            1000 * value for value in (self.percentile(50), self.percentile(95), self.percentile(99), self.max))
+
+
+class GatewayStats(object):
+    def __init__(self):
+        self.readings = 0
+        self.rejected = 0
+        self.batches = 0
+        self.acknowledged = 0
+        self.derived = 0
+        self.dropped = 0
+        self.ingest = LatencyStats()
+        self.end_to_end = LatencyStats()
+
+    def report(self):
+        return ("%d readings (%d rejected), %d batches (%d acknowledged), %d derived events (%d dropped for slow "
+                "subscribers); ingest %s; end-to-end %s" % (
+                    self.readings, self.rejected, self.batches, self.acknowledged, self.derived, self.dropped,
+                    self.ingest.report(), self.end_to_end.report()))
+
+
+class Gateway(object):
+    '''
+    :param engine: engine.Engine configuration of the engine process
+    :param batch_size: maximum number of readings per batch
+    :param batch_interval: seconds a batch waits for more readings before it is sent
+    :param max_pending: maximum number of batches sent and not yet acknowledged by the engine
+    :param queue_size: maximum number of readings waiting to be batched
+    '''
+    def __init__(self, engine, batch_size = DEFAULT_BATCH_SIZE, batch_interval = DEFAULT_BATCH_INTERVAL,
+                 max_pending = DEFAULT_MAX_PENDING, queue_size = DEFAULT_QUEUE_SIZE, pattern = HLA_PATTERN,
+                 sink_mode = "all", log_file = None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.queue_size = queue_size
+        self.pattern = pattern
+        self.sink_mode = sink_mode
+        self.log_file = log_file
+        self.stats = GatewayStats()
+
+        self.queue = None
+        self.pending = None
+        self.in_flight = {}
+        self.next_batch = 0
+        self.subscribers = set()
+        self.servers = []
+        self.proc = None
+        self.sink_reader = None
+        self.stopping = None
+
+    async def start_engine(self):
+        ## the event sink is written to a dedicated pipe, so the engine console output stays out of the event stream
+        read_fd, write_fd = os.pipe()
+        log = open(self.log_file, "w") if self.log_file else subprocess.DEVNULL
+        try:
+            preloaded = self.engine.preloaded()
+            goal = self.engine.serve_goal("/dev/fd/%d" % write_fd, self.pattern, self.sink_mode, preloaded)
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.engine.command(goal, preloaded),
+                stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT, pass_fds=(write_fd,),
+                cwd=os.path.dirname(os.path.abspath(self.engine.rules)))
+        finally:
+            os.close(write_fd)
+            if log is not subprocess.DEVNULL:
+                log.close()
+
+        loop = asyncio.get_running_loop()
+        self.sink_reader = asyncio.StreamReader(limit=2 ** 20)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.sink_reader), os.fdopen(read_fd, "rb"))
+
+    async def start(self, socket_path = None, port = None):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.stopping = asyncio.Event()
+
+        await self.start_engine()
+
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.servers.append(await asyncio.start_unix_server(self.handle_client, path=socket_path))
+        if port:
+            self.servers.append(await asyncio.start_server(self.handle_client, host="127.0.0.1", port=port))
+
+    async def handle_client(self, reader, writer):
+        try:
+            first = await reader.readline()
+            if first.strip() == SUBSCRIBE.encode():
+                await self.serve_subscriber(reader, writer)
+                return
+
+            line = first
+            while line:
+                received = time.monotonic()
+                try:
+                    reading = parse_reading(line.decode("utf-8", "replace")).to_etalis()
+                except (ValueError, OverflowError) as error:
+                    if line.strip():
+                        self.stats.rejected += 1
+                        writer.write(("error: %s\n" % error).encode())
+                else:
+                    self.stats.readings += 1
+                    ## blocks while the queue is full, so the connection is not read any further
+                    await self.queue.put((reading, received))
+                line = await reader.readline()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_subscriber(self, reader, writer):
+        queue = asyncio.Queue(maxsize=DEFAULT_SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        try:
+            while True:
+                line = await queue.get()
+                if line is None:
+                    break
+                writer.write(line.encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(queue)
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+            ## backpressure: wait for the engine to acknowledge an earlier batch
+            await self.pending.acquire()
+
+            batch_id = self.next_batch
+            self.next_batch += 1
+            self.in_flight[batch_id] = [received for _, received in batch]
+
+            payload = "".join(line + "\n" for line, _ in batch) + "batch_end(%d).\n" % batch_id
+            self.proc.stdin.write(payload.encode())
+            await self.proc.stdin.drain()
+            self.stats.batches += 1
+
+            now = time.monotonic()
+            for _, received in batch:
+                self.stats.ingest.add(now - received)
+
+        self.proc.stdin.close()
+
+    async def read_sink(self):
+        while True:
+            line = await self.sink_reader.readline()
+            if not line:
+                break
+            text = line.decode("utf-8", "replace").strip()
+            if not text:
+                continue
+
+            match = BATCH_DONE_REGEX.match(text)
+            if match:
+                now = time.monotonic()
+                for received in self.in_flight.pop(int(match.group(1)), []):
+                    self.stats.end_to_end.add(now - received)
+                self.stats.acknowledged += 1
+                self.pending.release()
+                continue
+
+            self.stats.derived += 1
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(text)
+                except asyncio.QueueFull:
+                    self.stats.dropped += 1
+
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    async def reporter(self, interval):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                print(self.stats.report(), file=sys.stderr)
+
+    def stop(self):
+        if not self.stopping.is_set():
+            self.stopping.set()
+            for server in self.servers:
+                server.close()
+            try:
+                self.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                asyncio.ensure_future(self.queue.put(None))
+
+    async def run(self, socket_path = None, port = None, report_interval = None):
+        '''
+        Serve until stop() is called (e.g. on SIGINT / SIGTERM); the readings received so far are processed,
+        the engine is shut down and its return code is returned
+        '''
+        await self.start(socket_path, port)
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        tasks = [asyncio.ensure_future(self.batcher()), asyncio.ensure_future(self.read_sink())]
+        if report_interval:
+            tasks.append(asyncio.ensure_future(self.reporter(report_interval)))
+
+        returncode = await self.proc.wait()
+        ## the engine exited by itself (e.g. failed to load), no batch will be acknowledged anymore
+        self.stop()
+        for task in tasks[:1] + tasks[2:]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for server in self.servers:
+            await server.wait_closed()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        return returncode
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Feed socket clients' readings to a long running engine.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="unix socket path (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=None, help="also listen on this localhost TCP port")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--batch-interval", type=float, default=DEFAULT_BATCH_INTERVAL,
+                        help="seconds a batch waits for more readings (default: %(default)s)")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="unacknowledged batches before ingest is throttled (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--sink-mode", default="all",
+                        help="event sink mode: all (safe), maximal (exact, written at the end) or maximal(Horizon) "
+                             "(approximate, see open_event_sink/3)")
+    parser.add_argument("--flag", action="append", default=None, help="ETALIS flag as name=value (repeatable)")
+    parser.add_argument("--rules", default=DEFAULT_RULES)
+    parser.add_argument("--etalis", default=DEFAULT_ETALIS)
+    parser.add_argument("--swipl", default=DEFAULT_SWIPL)
+    parser.add_argument("--image", default=None, help="saved engine state to start from, when fresh (see engine.py)")
+    parser.add_argument("--log", default=None, help="file receiving the engine console output")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between reports (0: at exit only)")
+    args = parser.parse_args(argv)
+
+    flags = parse_flags(args.flag) if args.flag else None
+    engine = Engine(rules=os.path.abspath(args.rules), etalis=os.path.abspath(args.etalis), flags=flags, swipl=args.swipl,
+                    image=args.image)
+    gateway = Gateway(engine, args.batch_size, args.batch_interval, args.max_pending, args.queue_size,
+                      sink_mode=args.sink_mode, log_file=args.log)
+
+    returncode = asyncio.run(gateway.run(args.socket, args.port, args.report_interval))
+    print(gateway.stats.report(), file=sys.stderr)
+
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
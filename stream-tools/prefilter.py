@@ -0,0 +1,193 @@
+'''
+Sensor-noise pre-filter, run between a .stream source and the engine.
+
+Atomic pos/lla readings whose certainty is not above the <type>_score_valid_threshold of the rule file can never
+satisfy the where-clauses of r_pos_1/r_pos_2 (resp. r_lla_1/r_lla_2), which require Score > ValidThresh for every
+atomic operand, and atomic events take part in no other rule (the hla rules and the fnot of r_pos_1/r_lla_1 only match
+complex, extended intervals). They still break the intervals though: under the recent consumption policy, an invalid
+reading consumes the goal of the reading (or interval) before it and is the first operand the next reading of the same
+(person, type, value) is paired with, so the valid readings on both sides of it are not joined. The first invalid
+reading of each run of the same (person, type, value) is therefore kept, which leaves the same goals as the whole run,
+and the rest of the run is dropped. The thresholds are read from the rule file, so both stay in sync.
+
+With --debounce, readings that are isolated - no other reading of the same (person, type, value) within
+<type>_max_rule_window seconds before or after - are dropped as well (e.g. single adjacency false detects). This
+delays the stream by the rule window and can also remove valid intervals that the rules would derive.
+'''
+from __future__ import print_function, division
+
+import argparse, collections, os, re, sys
+
+from scep import streams
+from engine import DEFAULT_RULES
+
+THRESHOLD_REGEX = re.compile(r"^\s*(?P<type>\w+?)_(?P<name>score_valid_threshold|score_diff_threshold|max_rule_window)"
+                             r"\(\s*(?P<value>[0-9.eE+-]+)\s*\)\s*\.", re.MULTILINE)
+
+FILTERED_TYPES = ("pos", "lla")
+
+
+def load_thresholds(rules_file = DEFAULT_RULES):
+    '''
+    Read the per sensor type thresholds of a rule file, e.g. pos_score_valid_threshold(0.5).
+    :param rules_file: ETALIS event rule file
+    :return: dict type -> dict name -> value
+    '''
+    with open(rules_file) as infile:
+        text = infile.read()
+
+    thresholds = collections.defaultdict(dict)
+    for match in THRESHOLD_REGEX.finditer(text):
+        thresholds[match.group("type")][match.group("name")] = float(match.group("value"))
+
+    return dict(thresholds)
+
+
+class PrefilterStats(object):
+    def __init__(self):
+        self.events_in = collections.Counter()
+        self.low_certainty = collections.Counter()
+        self.isolated = collections.Counter()
+
+    @property
+    def dropped(self):
+        return sum(self.low_certainty.values()) + sum(self.isolated.values())
+
+    @property
+    def reduction_ratio(self):
+        total = sum(self.events_in.values())
+        return self.dropped / total if total else 0.0
+
+    def report(self):
+        lines = []
+        for type in sorted(self.events_in):
+            lines.append("%s: %d in, %d below certainty threshold, %d isolated" % (
+                type, self.events_in[type], self.low_certainty[type], self.isolated[type]))
+        lines.append("%d of %d events dropped (reduction %.1f%%)" % (
+            self.dropped, sum(self.events_in.values()), 100 * self.reduction_ratio))
+        return "\n".join(lines)
+
+
+class _Item(object):
+    __slots__ = ("line", "event", "confirmed")
+
+    def __init__(self, line, event, confirmed):
+        self.line = line
+        self.event = event
+        self.confirmed = confirmed
+
+
+class Prefilter(object):
+    '''
+    Streaming filter: push() the stream lines in order, it returns the lines to forward; flush() returns the rest
+    '''
+    def __init__(self, thresholds, debounce = False):
+        self.valid = dict((type, thresholds.get(type, {}).get("score_valid_threshold")) for type in FILTERED_TYPES)
+        self.window = dict((type, thresholds.get(type, {}).get("max_rule_window")) for type in FILTERED_TYPES)
+        self.debounce = debounce
+        self.delay = max([window for window in self.window.values() if window is not None] or [0])
+        self.buffer = collections.deque()
+        self.last = {}
+        ## keys whose last reading was invalid: the rest of their run of invalid readings is dropped
+        self.invalid_run = set()
+        self.stats = PrefilterStats()
+
+    def push(self, line):
+        event = streams.parse_event(line)
+        if event is None:
+            return self._forward(_Item(line, None, True), None)
+
+        self.stats.events_in[event.type] += 1
+        valid = self.valid.get(event.type)
+        if valid is not None and event.start == event.end:
+            if event.certainty <= valid:
+                if event.key in self.invalid_run:
+                    self.stats.low_certainty[event.type] += 1
+                    return []
+                ## the first invalid reading of a run breaks the interval, it is kept
+                self.invalid_run.add(event.key)
+                return self._forward(_Item(line, event, True), event.end)
+            self.invalid_run.discard(event.key)
+
+        item = _Item(line, event, True)
+        window = self.window.get(event.type)
+        if self.debounce and window is not None and event.start == event.end:
+            ## a reading is kept if the previous or the next reading of the same kind is within the rule window
+            previous = self.last.get(event.key)
+            item.confirmed = previous is not None and event.end - previous.event.end <= window
+            if item.confirmed:
+                previous.confirmed = True
+            self.last[event.key] = item
+
+        return self._forward(item, event.end)
+
+    def _forward(self, item, now):
+        if not self.debounce:
+            return [item.line]
+
+        self.buffer.append(item)
+        if now is None:
+            return []
+        return self._release(now - self.delay)
+
+    def _release(self, limit):
+        lines = []
+        while self.buffer:
+            item = self.buffer[0]
+            if item.event is not None and limit is not None and item.event.end >= limit:
+                break
+            self.buffer.popleft()
+            if item.confirmed:
+                lines.append(item.line)
+            else:
+                self.stats.isolated[item.event.type] += 1
+                if self.last.get(item.event.key) is item:
+                    del self.last[item.event.key]
+
+        return lines
+
+    def flush(self):
+        return self._release(None)
+
+
+def prefilter(lines, output, thresholds, debounce = False):
+    '''
+    Filter a stream
+    :param lines: iterable of stream lines
+    :param output: file-like object receiving the forwarded lines
+    :return: PrefilterStats
+    '''
+    filter = Prefilter(thresholds, debounce)
+    for line in lines:
+        for forwarded in filter.push(line.rstrip("\r\n")):
+            output.write(forwarded + "\n")
+    for forwarded in filter.flush():
+        output.write(forwarded + "\n")
+
+    return filter.stats
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Drop sensor readings that the activity rules would reject.")
+    parser.add_argument("input", help="input event stream")
+    parser.add_argument("output", nargs="?", default=None, help="filtered stream (default: stdout)")
+    parser.add_argument("--rules", default=DEFAULT_RULES, help="rule file the thresholds are read from")
+    parser.add_argument("--debounce", action="store_true", help="also drop readings isolated within the rule window")
+    args = parser.parse_args(argv)
+
+    thresholds = load_thresholds(os.path.abspath(args.rules))
+
+    with open(args.input) as infile:
+        if args.output:
+            with open(args.output, "w") as outfile:
+                stats = prefilter(infile, outfile, thresholds, args.debounce)
+        else:
+            stats = prefilter(infile, sys.stdout, thresholds, args.debounce)
+
+    print(stats.report(), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+'''
+Out-of-order tolerant ingest: reorders the events of one or more streams by timestamp within a bounded lateness,
+using a heap, before they are fed to the engine (which assumes timestamp order).
+
+An event is held until the stream has moved `lateness` seconds past it; events arriving after events later than
+them by more than the lateness bound have already been overtaken and are dropped (or kept, out of order, with
+--late keep), and can be written to a separate file for inspection.
+
+Several input streams are merged by timestamp before the reorder buffer, so that streams with different event rates
+or time spans do not drift apart. The lines that are not events (sleep(N) statements, comments) are passed through:
+they take the timestamp of the preceding event of their stream and go through the reorder buffer with it, so that a
+sleep(N) is still written after the events before it and the replay timing is kept.
+'''
+from __future__ import print_function, division
+
+import argparse, heapq, sys
+
+from scep import streams
+
+DEFAULT_LATENESS = 2
+
+
+class ReorderStats(object):
+    def __init__(self):
+        self.events_in = 0
+        self.events_out = 0
+        self.reordered = 0
+        self.late = 0
+        self.max_occupancy = 0
+        self.occupancy_sum = 0
+        self.max_displacement = 0.0
+        self.passed_through = 0
+
+    @property
+    def mean_occupancy(self):
+        return self.occupancy_sum / self.events_in if self.events_in else 0.0
+
+    def report(self):
+        return ("%d events in, %d out, %d reordered, %d late; buffer occupancy max %d, mean %.1f; "
+                "max displacement %.3fs; %d other lines passed through" % (
+                    self.events_in, self.events_out, self.reordered, self.late, self.max_occupancy,
+                    self.mean_occupancy, self.max_displacement, self.passed_through))
+
+
+class Reorderer(object):
+    '''
+    Bounded reorder buffer: push() the events as they arrive, it returns the events that are due, in timestamp order;
+    push_line() the other lines with the timestamp of the event before them; drain() returns the rest at the end of the
+    stream
+    '''
+    def __init__(self, lateness = DEFAULT_LATENESS, keep_late = False, on_late = None):
+        self.lateness = lateness
+        self.keep_late = keep_late
+        ## called with each late event
+        self.on_late = on_late
+        self.heap = []
+        self.seq = 0
+        self.watermark = None
+        self.last_released = None
+        self.max_released_seq = -1
+        self.stats = ReorderStats()
+
+    def push(self, event):
+        '''
+        :param event: streams.StreamEvent
+        :return: list of the events released by this arrival
+        '''
+        stats = self.stats
+        stats.events_in += 1
+
+        if self.last_released is not None and event.end < self.last_released:
+            ## overtaken by an already released event
+            stats.late += 1
+            if self.on_late:
+                self.on_late(event)
+            if self.keep_late:
+                stats.events_out += 1
+                return [event]
+            return []
+
+        heapq.heappush(self.heap, (event.end, self.seq, event))
+        self.seq += 1
+
+        if self.watermark is None or event.end > self.watermark:
+            self.watermark = event.end
+        else:
+            stats.max_displacement = max(stats.max_displacement, self.watermark - event.end)
+
+        stats.max_occupancy = max(stats.max_occupancy, len(self.heap))
+        stats.occupancy_sum += len(self.heap)
+
+        return self._release(self.watermark - self.lateness)
+
+    def push_line(self, line, timestamp):
+        '''
+        :param line: stream line that is not an event
+        :param timestamp: end of the event before it
+        :return: list of the lines released by this arrival
+        '''
+        self.stats.passed_through += 1
+        ## nothing held before it: the events it follows are already written
+        if not self.heap or timestamp < self.heap[0][0]:
+            return [line]
+
+        heapq.heappush(self.heap, (timestamp, self.seq, line))
+        self.seq += 1
+        return []
+
+    def _release(self, limit):
+        released = []
+        while self.heap and (limit is None or self.heap[0][0] <= limit):
+            end, seq, item = heapq.heappop(self.heap)
+            released.append(item)
+            if not isinstance(item, streams.StreamEvent):
+                continue
+            ## released after an event that arrived later
+            if seq < self.max_released_seq:
+                self.stats.reordered += 1
+            self.max_released_seq = max(self.max_released_seq, seq)
+            self.last_released = end
+            self.stats.events_out += 1
+
+        return released
+
+    def drain(self):
+        return self._release(None)
+
+
+def timestamped_items(lines, idx = 0):
+    '''
+    Events and other non-blank lines of a stream, keyed for merging by timestamp; the other lines take the timestamp
+    of the event before them in the stream (minus infinity before the first one), so that they stay after it
+    :param lines: iterable of stream lines
+    :param idx: index of the stream, breaking timestamp ties between streams
+    :return: generator of (timestamp, stream index, line number, StreamEvent or line)
+    '''
+    timestamp = float("-inf")
+    for seq, line in enumerate(lines):
+        event = streams.parse_event(line)
+        if event is None:
+            if line.strip():
+                yield (timestamp, idx, seq, line.rstrip("\r\n"))
+            continue
+        timestamp = event.end
+        yield (timestamp, idx, seq, event)
+
+
+def merge_streams(inputs):
+    '''
+    Merge several streams by timestamp; each one is expected in timestamp order, up to the lateness bound
+    :param inputs: list of iterables of stream lines
+    :return: generator of (timestamp, StreamEvent or other line)
+    '''
+    for timestamp, _, _, item in heapq.merge(*[timestamped_items(lines, idx) for idx, lines in enumerate(inputs)]):
+        yield timestamp, item
+
+
+def reorder(inputs, output, lateness = DEFAULT_LATENESS, keep_late = False, late_output = None):
+    '''
+    Reorder the events of one or more streams
+    :param inputs: list of iterables of stream lines, one per stream
+    :param output: file-like object receiving the ordered events
+    :param late_output: optional file-like object receiving the late events
+    :return: ReorderStats
+    '''
+    def on_late(event):
+        if late_output is not None:
+            late_output.write((event.line or event.to_etalis()) + "\n")
+
+    reorderer = Reorderer(lateness, keep_late, on_late)
+
+    def write(item):
+        if isinstance(item, streams.StreamEvent):
+            output.write((item.line or item.to_etalis()) + "\n")
+        else:
+            output.write(item + "\n")
+
+    for timestamp, item in merge_streams(inputs):
+        if isinstance(item, streams.StreamEvent):
+            released = reorderer.push(item)
+        else:
+            released = reorderer.push_line(item, timestamp)
+        for released_item in released:
+            write(released_item)
+
+    for released_item in reorderer.drain():
+        write(released_item)
+
+    return reorderer.stats
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Reorder event streams by timestamp within a lateness bound.")
+    parser.add_argument("output", help="ordered output stream ('-' for stdout)")
+    parser.add_argument("inputs", nargs="+", help="input streams, merged by timestamp when several are given")
+    parser.add_argument("--lateness", type=float, default=DEFAULT_LATENESS,
+                        help="seconds an event may arrive after later events (default: %(default)s)")
+    parser.add_argument("--late", choices=["drop", "keep"], default="drop",
+                        help="what to do with events later than the bound (default: %(default)s)")
+    parser.add_argument("--late-file", default=None, help="file receiving the late events")
+    args = parser.parse_args(argv)
+
+    infiles = [open(name) for name in args.inputs]
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+    late_file = open(args.late_file, "w") if args.late_file else None
+
+    try:
+        stats = reorder(infiles, outfile, args.lateness, args.late == "keep", late_file)
+    finally:
+        for infile in infiles:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+        if late_file:
+            late_file.close()
+
+    print(stats.report(), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+'''
+Time-bucketed rollups of input and output streams: per series (event type, person, value), and per time bucket of
+one or more resolutions (1s, 1m, 1h by default), the number of events, their summed certainty and the occupancy, the
+seconds of the bucket covered by the events of the series.
+
+Events are parsed into columnar chunks and rolled up with NumPy: bucket indices are integers (time // resolution),
+a (series, bucket) pair is one int64 key, and the chunk and stored rollups are merged by sorting the keys and summing
+the columns with np.add.reduceat. The rollups are kept as sparse (key, columns) arrays in a compressed .npz file:
+
+- occupancy is the union of the event intervals of a series: events are swept in start order per series, each one
+  only adding the part past what the series already covers. Atomic readings (start = end) cover reading_duration
+  seconds, and the successive derivations of an output interval only add their extension;
+- the file also records the offset read in every input file and the coverage of every series, so that a later update
+  only reads what was appended to the files since. The sweep is exact when events arrive in time order, as in the
+  generated and engine streams.
+
+The per-person, per-area (pos values) and per-activity (lla/hla values) views are sums of the series rollups, see
+Rollups.view; mean certainty is the summed certainty over the event count.
+'''
+from __future__ import print_function
+
+import argparse, os, sys
+
+import numpy as np
+
+from scep import streams
+
+DEFAULT_RESOLUTIONS = (1, 60, 3600)
+DEFAULT_READING_DURATION = 1.0
+
+CHUNK_EVENTS = 200000
+
+## key = series << BUCKET_BITS | bucket
+BUCKET_BITS = 34
+
+COLUMNS = ("count", "certainty", "occupancy")
+
+VIEWS = {
+    "person":   ("person", None),
+    "area":     ("value", ("pos",)),
+    "activity": ("value", ("lla", "hla")),
+}
+
+
+def reduce_by_key(keys, columns):
+    '''
+    Sum the columns of equal keys
+    :param keys: int64 array
+    :param columns: list of arrays, aligned with keys
+    :return: (sorted unique keys, list of summed columns)
+    '''
+    if not len(keys):
+        return keys, columns
+
+    order = np.argsort(keys, kind="mergesort")
+    keys = keys[order]
+    starts = np.concatenate(([0], np.nonzero(np.diff(keys))[0] + 1))
+
+    return keys[starts], [np.add.reduceat(column[order], starts) for column in columns]
+
+
+def expand_buckets(series, start, end, resolution):
+    '''
+    Split intervals over the buckets of a resolution
+    :return: (keys, seconds of each interval in each bucket)
+    '''
+    first = np.floor(start / resolution).astype(np.int64)
+    last = np.floor(end / resolution).astype(np.int64)
+    ## an interval ending on a bucket boundary does not cover the next bucket
+    last = np.maximum(first, np.where(last * resolution == end, last - 1, last))
+
+    lengths = last - first + 1
+    rows = np.repeat(np.arange(len(first)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    buckets = first[rows] + (np.arange(int(lengths.sum())) - offsets[rows])
+
+    seconds = (np.minimum(end[rows], (buckets + 1) * float(resolution))
+               - np.maximum(start[rows], buckets * float(resolution)))
+
+    return (series[rows] << BUCKET_BITS) | buckets, seconds
+
+
+class Rollups(object):
+    '''
+    Rollups of a set of streams, updated incrementally with update() and stored with save()/load()
+    :param resolutions: bucket sizes, in seconds
+    :param reading_duration: seconds covered by an atomic reading
+    '''
+    def __init__(self, resolutions = DEFAULT_RESOLUTIONS, reading_duration = DEFAULT_READING_DURATION):
+        self.resolutions = tuple(int(resolution) for resolution in resolutions)
+        self.reading_duration = float(reading_duration)
+
+        self.series = []
+        self.series_index = {}
+        self.covered_until = np.zeros(0)
+        self.offsets = {}
+
+        self.keys = dict((resolution, np.zeros(0, dtype=np.int64)) for resolution in self.resolutions)
+        self.columns = dict((resolution, [np.zeros(0) for _ in COLUMNS]) for resolution in self.resolutions)
+
+    def series_id(self, type, person, value):
+        key = (type, person, value)
+        idx = self.series_index.get(key)
+        if idx is None:
+            idx = self.series_index[key] = len(self.series)
+            self.series.append(key)
+        return idx
+
+    def update(self, path):
+        '''
+        Roll up the complete lines appended to a stream file since the last update
+        :return: number of events read
+        '''
+        path = os.path.abspath(path)
+        offset = self.offsets.get(path, 0)
+        if os.path.getsize(path) < offset:
+            raise ValueError("%s is smaller than at the last update, it was not appended to" % path)
+
+        read = 0
+        with open(path, "rb") as infile:
+            infile.seek(offset)
+            chunk = []
+            for raw in infile:
+                if not raw.endswith(b"\n"):
+                    ## incomplete last line, read at the next update
+                    break
+                offset += len(raw)
+                event = streams.parse_event(raw.decode("utf-8"))
+                if event is None:
+                    continue
+                chunk.append((self.series_id(event.type, event.person, event.value),
+                              event.certainty, event.start, event.end))
+                if len(chunk) >= CHUNK_EVENTS:
+                    read += self.add_chunk(chunk)
+                    chunk = []
+            read += self.add_chunk(chunk)
+
+        self.offsets[path] = offset
+        return read
+
+    def add_chunk(self, chunk):
+        '''
+        Roll up a chunk of (series id, certainty, start, end) events
+        :return: number of events
+        '''
+        if not chunk:
+            return 0
+
+        series, certainty, start, end = (np.array(column) for column in zip(*chunk))
+        series = series.astype(np.int64)
+        end = np.where(end > start, end, start + self.reading_duration)
+
+        if len(self.covered_until) < len(self.series):
+            self.covered_until = np.concatenate((self.covered_until,
+                                                 np.full(len(self.series) - len(self.covered_until), -np.inf)))
+
+        ## coverage sweep, in start order per series: the running maximum of the ends is kept within a series by
+        ## offsetting each series by more than the time span of the chunk
+        order = np.lexsort((start, series))
+        series, certainty, start, end = series[order], certainty[order], start[order], end[order]
+        origin = start.min()
+        span = end.max() - origin + 1.0
+        running = np.maximum.accumulate(series * span + (end - origin))
+        previous = np.concatenate(([-np.inf], running[:-1])) - series * span + origin
+        first_of_series = np.concatenate(([True], series[1:] != series[:-1]))
+        previous[first_of_series] = -np.inf
+        covered = np.maximum(previous, self.covered_until[series])
+
+        last_of_series = np.concatenate((first_of_series[1:], [True]))
+        self.covered_until[series[last_of_series]] = np.maximum(self.covered_until[series[last_of_series]],
+                                                                running[last_of_series] - series[last_of_series] * span
+                                                                + origin)
+
+        adds = end > covered
+        cover_start = np.maximum(start, covered)[adds]
+
+        for resolution in self.resolutions:
+            ## count and certainty go to the bucket of the event end, occupancy to every bucket it covers
+            event_keys = (series << BUCKET_BITS) | np.floor(end / resolution).astype(np.int64)
+            cover_keys, seconds = expand_buckets(series[adds], cover_start, end[adds], resolution)
+
+            keys = np.concatenate((self.keys[resolution], event_keys, cover_keys))
+            stored = self.columns[resolution]
+            counts = np.concatenate((stored[0], np.ones(len(event_keys)), np.zeros(len(cover_keys))))
+            certainties = np.concatenate((stored[1], certainty, np.zeros(len(cover_keys))))
+            occupancy = np.concatenate((stored[2], np.zeros(len(event_keys)), seconds))
+
+            self.keys[resolution], self.columns[resolution] = reduce_by_key(keys, [counts, certainties, occupancy])
+
+        return len(chunk)
+
+    def view(self, resolution, by = "activity", types = None):
+        '''
+        Sum the series rollups of a resolution per person or per value
+        :param by: a VIEWS name (person, area, activity)
+        :param types: event types to include (default: those of the view, all for the person view)
+        :return: dict name -> (bucket start times, count, mean certainty, occupancy) arrays
+        '''
+        field, view_types = VIEWS[by]
+        types = types if types is not None else view_types
+        keys = self.keys[resolution]
+        series = keys >> BUCKET_BITS
+        buckets = keys & ((1 << BUCKET_BITS) - 1)
+
+        names = sorted(set(key[1] if field == "person" else key[2] for key in self.series
+                           if types is None or key[0] in types))
+        name_index = dict((name, idx) for idx, name in enumerate(names))
+        series_name = np.array([name_index.get(key[1] if field == "person" else key[2], -1)
+                                if types is None or key[0] in types else -1 for key in self.series], dtype=np.int64)
+
+        name_ids = series_name[series] if len(series) else np.zeros(0, dtype=np.int64)
+        selected = name_ids >= 0
+        view_keys, (count, certainty, occupancy) = reduce_by_key(
+            (name_ids[selected] << BUCKET_BITS) | buckets[selected],
+            [column[selected] for column in self.columns[resolution]])
+
+        result = {}
+        view_names = view_keys >> BUCKET_BITS
+        view_buckets = view_keys & ((1 << BUCKET_BITS) - 1)
+        for idx, name in enumerate(names):
+            rows = view_names == idx
+            mean_certainty = np.where(count[rows] > 0, certainty[rows] / np.maximum(count[rows], 1), np.nan)
+            result[name] = (view_buckets[rows] * resolution, count[rows], mean_certainty, occupancy[rows])
+
+        return result
+
+    def save(self, path):
+        '''
+        Write the rollups to a compressed .npz file, atomically
+        '''
+        arrays = {
+            "resolutions": np.array(self.resolutions, dtype=np.int64),
+            "reading_duration": np.array(self.reading_duration),
+            "series_type": np.array([key[0] for key in self.series], dtype="U"),
+            "series_person": np.array([key[1] for key in self.series], dtype="U"),
+            "series_value": np.array([key[2] for key in self.series], dtype="U"),
+            "covered_until": self.covered_until,
+            "files": np.array(sorted(self.offsets), dtype="U"),
+            "offsets": np.array([self.offsets[stream_file] for stream_file in sorted(self.offsets)], dtype=np.int64),
+        }
+        for resolution in self.resolutions:
+            arrays["keys_%d" % resolution] = self.keys[resolution]
+            for column, values in zip(COLUMNS, self.columns[resolution]):
+                arrays["%s_%d" % (column, resolution)] = values
+
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            rollups = cls(data["resolutions"].tolist(), float(data["reading_duration"]))
+            for key in zip(data["series_type"], data["series_person"], data["series_value"]):
+                rollups.series_id(*(str(field) for field in key))
+            rollups.covered_until = data["covered_until"]
+            rollups.offsets = dict(zip((str(stream_file) for stream_file in data["files"]), data["offsets"].tolist()))
+            for resolution in rollups.resolutions:
+                rollups.keys[resolution] = data["keys_%d" % resolution]
+                rollups.columns[resolution] = [data["%s_%d" % (column, resolution)] for column in COLUMNS]
+
+        return rollups
+
+
+def parse_resolution(text):
+    '''
+    :param text: seconds, optionally suffixed with s, m or h (e.g. 1s, 5m, 1h)
+    :return: seconds (int)
+    '''
+    multipliers = {"s": 1, "m": 60, "h": 3600}
+    text = text.strip()
+    if text and text[-1] in multipliers:
+        return int(text[:-1]) * multipliers[text[-1]]
+    return int(text)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Time-bucketed rollups of event streams, updated incrementally.")
+    parser.add_argument("rollups", help="rollup file (.npz), created or updated")
+    parser.add_argument("streams", nargs="*", help="stream files to roll up (only what was appended since the last "
+                                                   "update is read)")
+    parser.add_argument("--resolutions", default="1s,1m,1h",
+                        help="comma separated bucket sizes, for a new rollup file (default: %(default)s)")
+    parser.add_argument("--reading-duration", type=float, default=DEFAULT_READING_DURATION,
+                        help="seconds covered by an atomic reading, for a new rollup file (default: %(default)s)")
+    parser.add_argument("--show", choices=sorted(VIEWS), default=None, help="print a view of the rollups")
+    parser.add_argument("--resolution", default=None, help="resolution of the printed view (default: the coarsest)")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.rollups):
+        rollups = Rollups.load(args.rollups)
+    else:
+        rollups = Rollups([parse_resolution(resolution) for resolution in args.resolutions.split(",")],
+                          args.reading_duration)
+
+    for stream_file in args.streams:
+        read = rollups.update(stream_file)
+        print("%s: %d events rolled up" % (stream_file, read), file=sys.stderr)
+
+    if args.streams or not os.path.exists(args.rollups):
+        rollups.save(args.rollups)
+
+    if args.show:
+        resolution = parse_resolution(args.resolution) if args.resolution else max(rollups.resolutions)
+        if resolution not in rollups.resolutions:
+            parser.error("the rollups have no %ds resolution" % resolution)
+        for name, (times, count, certainty, occupancy) in sorted(rollups.view(resolution, args.show).items()):
+            for time, bucket_count, bucket_certainty, bucket_occupancy in zip(times, count, certainty, occupancy):
+                print("%s\t%s\t%d\t%.4f\t%.1f" % (name, streams.format_time(time), bucket_count, bucket_certainty,
+                                                  bucket_occupancy))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
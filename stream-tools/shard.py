@@ -0,0 +1,159 @@
+'''
+Per-person sharded execution of the activity rules. Every rule of activity-test.event is scoped by the person U and
+no rule joins events of different persons, so the input stream can be partitioned by person and run by independent
+engine workers in parallel; their hla outputs are merged back into one file ordered by interval end (then start).
+'''
+from __future__ import print_function
+
+import argparse, heapq, multiprocessing, os, sys, tempfile, threading, time
+
+from scep import streams
+from engine import Engine, parse_flags, DEFAULT_RULES, DEFAULT_ETALIS, DEFAULT_SWIPL, HLA_PATTERN
+
+
+def partition_stream(stream_file, shard_files):
+    '''
+    Split a stream by the person of its events. Persons are assigned round robin to the shards, in order of first
+    appearance; lines that are not events (e.g. sleep(N) statements) are copied to every shard, comments are dropped.
+    :param stream_file: input stream file
+    :param shard_files: output file names, one per shard
+    :return: dict person -> shard index, and the number of events written to each shard
+    '''
+    outputs = [open(shard_file, "w") for shard_file in shard_files]
+    assignment = {}
+    counts = [0] * len(shard_files)
+
+    try:
+        with open(stream_file) as infile:
+            for line in infile:
+                stripped = line.strip()
+                if not stripped or stripped.startswith("%"):
+                    continue
+
+                event = streams.parse_event(line)
+                if event is None:
+                    for output in outputs:
+                        output.write(stripped + "\n")
+                    continue
+
+                shard = assignment.setdefault(event.person, len(assignment) % len(outputs))
+                outputs[shard].write(stripped + "\n")
+                counts[shard] += 1
+    finally:
+        for output in outputs:
+            output.close()
+
+    return assignment, counts
+
+
+def sorted_shard_events(output_file, shard):
+    '''
+    Read the output of one worker, ordered by interval end and start
+    '''
+    if not os.path.exists(output_file):
+        return []
+
+    with open(output_file) as infile:
+        decorated = [(event.end, event.start, shard, idx, event.line)
+                     for idx, event in enumerate(streams.read_events(infile))]
+    decorated.sort()
+
+    return decorated
+
+
+def merge_outputs(output_files, merged_file):
+    '''
+    Merge the worker outputs into a single file ordered by interval end, then start
+    :return: number of events written
+    '''
+    count = 0
+    with open(merged_file, "w") as outfile:
+        for _, _, _, _, line in heapq.merge(*[sorted_shard_events(output_file, shard)
+                                              for shard, output_file in enumerate(output_files)]):
+            outfile.write(line + "\n")
+            count += 1
+
+    return count
+
+
+def run_sharded(engine, stream_file, merged_file, workers, work_dir, sink_mode = "all"):
+    '''
+    Partition stream_file, run one engine per shard in parallel and merge their outputs
+    :return: list of per-shard EngineResults and the number of merged output events
+    '''
+    base = os.path.join(work_dir, os.path.splitext(os.path.basename(stream_file))[0])
+    shard_files = ["%s.shard%d.stream" % (base, idx) for idx in range(workers)]
+    output_files = ["%s.shard%d.hla_output.stream" % (base, idx) for idx in range(workers)]
+    log_files = ["%s.shard%d.log" % (base, idx) for idx in range(workers)]
+
+    assignment, counts = partition_stream(stream_file, shard_files)
+    used = [idx for idx in range(workers) if counts[idx]]
+
+    results = [None] * workers
+
+    def work(idx):
+        results[idx] = engine.run(shard_files[idx], output_files[idx], log_files[idx],
+                                  pattern=HLA_PATTERN, sink_mode=sink_mode)
+
+    ## each worker is a separate swipl process, the threads only wait for them
+    threads = [threading.Thread(target=work, args=(idx,)) for idx in used]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = merge_outputs([output_files[idx] for idx in used], merged_file)
+
+    return assignment, counts, results, merged
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Run the activity rules over a stream, sharded by person.")
+    parser.add_argument("stream", help="input event stream")
+    parser.add_argument("output", help="merged hla output stream")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--flag", action="append", default=None, help="ETALIS flag as name=value (repeatable)")
+    parser.add_argument("--sink-mode", default="all",
+                        help="event sink mode: all (safe), maximal (exact, written at the end) or maximal(Horizon) "
+                             "(approximate, see open_event_sink/3)")
+    parser.add_argument("--rules", default=DEFAULT_RULES)
+    parser.add_argument("--etalis", default=DEFAULT_ETALIS)
+    parser.add_argument("--swipl", default=DEFAULT_SWIPL)
+    parser.add_argument("--image", default=None, help="saved engine state to start from, when fresh (see engine.py)")
+    parser.add_argument("--work-dir", default=None, help="directory for the shard streams and engine logs")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    flags = parse_flags(args.flag) if args.flag else None
+    engine = Engine(rules=os.path.abspath(args.rules), etalis=os.path.abspath(args.etalis), flags=flags, swipl=args.swipl,
+                    image=args.image)
+
+    ## swipl runs in the rules directory: the paths passed to it are absolute
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="scep-shard-")
+    output = os.path.abspath(args.output)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    start = time.time()
+    assignment, counts, results, merged = run_sharded(engine, os.path.abspath(args.stream), output,
+                                                      args.workers, work_dir, args.sink_mode)
+
+    failed = 0
+    for idx, result in enumerate(results):
+        if result is None:
+            continue
+        persons = sorted(person for person, shard in assignment.items() if shard == idx)
+        print("shard %d: %d events, persons %s, %.2fs, rss %skB%s" % (
+            idx, counts[idx], ",".join(persons), result.wall_seconds, result.peak_rss_kb,
+            "" if result.ok else ", FAILED (see " + result.log_file + ")"))
+        failed += not result.ok
+
+    print("%d hla events merged into %s in %.2fs" % (merged, output, time.time() - start))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())